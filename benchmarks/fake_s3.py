@@ -0,0 +1,239 @@
+"""
+Minimal local stand-in for S3, implementing the calls made by the pipeline with path-style addressing:
+ListBuckets, PutObject, GetObject, HeadObject and the multipart upload calls.
+
+Objects are kept in memory. With keep_objects=False (the default of the benchmarks), only their size is kept.
+
+Run it standalone with:
+    python -m benchmarks.fake_s3 --port 8090
+and point the pipeline to it with S3_ENDPOINT_URL=http://127.0.0.1:8090
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import threading
+import time
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+S3_XMLNS = 'http://s3.amazonaws.com/doc/2006-03-01/'
+
+
+class FakeS3Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately: without TCP_NODELAY, every response waits for the delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _target(self):
+        url = urlsplit(self.path)
+        bucket, _, key = unquote(url.path).lstrip('/').partition('/')
+        params = {name: values[0] for name, values in parse_qs(url.query, keep_blank_values=True).items()}
+        return bucket, key, params
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _send(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _send_xml(self, status, root, content):
+        body = f'<?xml version="1.0" encoding="UTF-8"?><{root} xmlns="{S3_XMLNS}">{content}</{root}>'
+        self._send(status, body.encode('utf-8'), {'Content-Type': 'application/xml'})
+
+    def _error(self, status, code, message):
+        self._send_xml(status, 'Error', f"<Code>{code}</Code><Message>{escape(message)}</Message>")
+
+    def do_GET(self):
+        bucket, key, params = self._target()
+        server = self.server
+
+        if bucket == '_stats':
+            self._send(200, json.dumps(server.snapshot()).encode('utf-8'), {'Content-Type': 'application/json'})
+            return
+        server.count('GetObject' if key else 'ListBuckets')
+
+        if not bucket:
+            buckets = ''.join(f"<Bucket><Name>{escape(name)}</Name><CreationDate>2024-01-01T00:00:00.000Z</CreationDate></Bucket>"
+                              for name in sorted(server.buckets))
+            self._send_xml(200, 'ListAllMyBucketsResult', f"<Owner><ID>fake</ID></Owner><Buckets>{buckets}</Buckets>")
+            return
+
+        stored = server.objects.get((bucket, key))
+        if stored is None:
+            self._error(404, 'NoSuchKey', f"{bucket}/{key} does not exist")
+            return
+        self._send(200, stored['body'] or b'', stored['headers'])
+
+    def do_HEAD(self):
+        bucket, key, _ = self._target()
+        self.server.count('HeadObject')
+        stored = self.server.objects.get((bucket, key))
+        if stored is None:
+            self._send(404)
+            return
+        self.send_response(200)
+        for name, value in stored['headers'].items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(stored['size']))
+        self.end_headers()
+
+    def do_PUT(self):
+        bucket, key, params = self._target()
+        server = self.server
+        body = self._read_body()
+        server.add_bytes(len(body))
+
+        if not key:
+            server.count('CreateBucket')
+            server.buckets.add(bucket)
+            self._send(200)
+            return
+
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if 'uploadId' in params:
+            server.count('UploadPart')
+            upload = server.uploads.get(params['uploadId'])
+            if upload is None:
+                self._error(404, 'NoSuchUpload', params['uploadId'])
+                return
+            upload['parts'][int(params['partNumber'])] = body if server.keep_objects else len(body)
+            self._send(200, headers={'ETag': etag})
+            return
+
+        server.count('PutObject')
+        server.buckets.add(bucket)
+        server.store(bucket, key, body, self._object_headers())
+        self._send(200, headers={'ETag': etag})
+
+    def do_POST(self):
+        bucket, key, params = self._target()
+        server = self.server
+        self._read_body()
+
+        if 'uploads' in params:
+            server.count('CreateMultipartUpload')
+            upload_id = uuid.uuid4().hex
+            server.uploads[upload_id] = {'bucket': bucket, 'key': key, 'headers': self._object_headers(), 'parts': {}}
+            self._send_xml(200, 'InitiateMultipartUploadResult',
+                           f"<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId>")
+            return
+
+        if 'uploadId' in params:
+            server.count('CompleteMultipartUpload')
+            upload = server.uploads.pop(params['uploadId'], None)
+            if upload is None:
+                self._error(404, 'NoSuchUpload', params['uploadId'])
+                return
+            parts = [upload['parts'][number] for number in sorted(upload['parts'])]
+            body = b''.join(parts) if server.keep_objects else sum(parts)
+            server.buckets.add(bucket)
+            server.store(bucket, key, body, upload['headers'])
+            self._send_xml(200, 'CompleteMultipartUploadResult',
+                           f"<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key><ETag>\"{uuid.uuid4().hex}\"</ETag>")
+            return
+
+        self._error(400, 'InvalidRequest', 'Unsupported POST request')
+
+    def do_DELETE(self):
+        bucket, key, params = self._target()
+        server = self.server
+        if 'uploadId' in params:
+            server.count('AbortMultipartUpload')
+            server.uploads.pop(params['uploadId'], None)
+        else:
+            server.count('DeleteObject')
+            server.objects.pop((bucket, key), None)
+        self._send(204)
+
+    def _object_headers(self):
+        return {name: self.headers[name] for name in ('Content-Type', 'Content-Encoding') if self.headers.get(name)}
+
+
+class FakeS3Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, keep_objects=False):
+        super().__init__(address, FakeS3Handler)
+        self.keep_objects = keep_objects
+        self.lock = threading.Lock()
+        self.buckets = set()
+        self.objects = {}
+        self.uploads = {}
+        self.stats = {'requests': {}, 'bytes_received': 0}
+
+    def count(self, operation):
+        with self.lock:
+            self.stats['requests'][operation] = self.stats['requests'].get(operation, 0) + 1
+
+    def add_bytes(self, size):
+        with self.lock:
+            self.stats['bytes_received'] += size
+
+    def store(self, bucket, key, body, headers):
+        size = body if isinstance(body, int) else len(body)
+        self.objects[(bucket, key)] = {'body': body if self.keep_objects else None, 'size': size, 'headers': headers}
+
+    def snapshot(self):
+        with self.lock:
+            stats = json.loads(json.dumps(self.stats))
+        stats['objects'] = {f"{bucket}/{key}": dict(stored['headers'], size=stored['size'])
+                            for (bucket, key), stored in list(self.objects.items())}
+        stats['pending_uploads'] = len(self.uploads)
+        return stats
+
+
+def serve(port, keep_objects=False):
+    """
+    Serve the fake S3 on 127.0.0.1:`port` until the process is terminated.
+    """
+    FakeS3Server(('127.0.0.1', port), keep_objects).serve_forever()
+
+
+def fetch_stats(url):
+    """
+    Returns the counters of a running fake S3: requests per operation, bytes received, stored objects.
+    """
+    with urllib.request.urlopen(f"{url}/_stats") as response:
+        return json.loads(response.read())
+
+
+def start_in_process(port, keep_objects=False):
+    """
+    Start the fake S3 in a separate process, so that it does not weigh on the measured process.
+
+    Returns:
+        tuple: (process, url), terminate the process to stop the server.
+    """
+    process = multiprocessing.Process(target=serve, args=(port, keep_objects), daemon=True)
+    process.start()
+
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            fetch_stats(url)
+            break
+        except OSError:
+            time.sleep(0.05)
+    return process, url
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--keep-objects', action='store_true')
+    args = parser.parse_args()
+
+    serve(args.port, args.keep_objects)
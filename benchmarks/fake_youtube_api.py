@@ -0,0 +1,479 @@
+"""
+Local fake of the YouTube Data API v3, serving synthetic channels, videos and comments.
+
+Only the endpoints used by the pipeline are implemented: channels.list, playlistItems.list, videos.list,
+commentThreads.list and comments.list, also through the batch endpoint (POST /batch). The data is generated on the fly from the configuration, so the
+server uses the same memory whatever the size of the synthetic channels. Like the real API, the responses
+honour the `fields` partial-response mask and are gzip-compressed when the client accepts it.
+
+Run it standalone with:
+    python -m benchmarks.fake_youtube_api --port 8089 --channels 5 --videos 200 --comments 50
+and point the pipeline to it with YOUTUBE_API_ENDPOINT=http://127.0.0.1:8089/
+"""
+import argparse
+import gzip
+import json
+import multiprocessing
+import random
+import threading
+import time
+import urllib.request
+import uuid
+from datetime import datetime, timedelta, timezone
+from email.parser import BytesParser
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+DEFAULT_CONFIG = {
+    'channels': 5,  # Number of synthetic channels
+    'videos_per_channel': 200,
+    'comments_per_video': 50,  # Number of comment threads per video
+    'replies_per_thread': 2,  # Number of replies of the threads having replies
+    'reply_every': 5,  # One thread out of `reply_every` has replies
+    'max_page_size': 100,  # Upper bound of maxResults, the real API caps it at 50 or 100 depending on the endpoint
+    'latency': 0.0,  # Seconds added to every response
+    'error_rate': 0.0,  # Probability of answering with an error
+    'error_statuses': [500],  # HTTP statuses of the injected errors, picked at random
+    'seed': 0,
+}
+
+# Reason of the injected errors, by status
+ERROR_REASONS = {403: 'forbidden', 429: 'rateLimitExceeded', 500: 'backendError', 503: 'backendError'}
+
+# Number of inline replies returned by commentThreads.list, like the real API
+INLINE_REPLIES = 5
+
+
+def parse_fields(mask):
+    """
+    Parse a partial-response mask, e.g. 'nextPageToken,items(id,snippet/title)', into a tree of
+    {field: subtree}, where a None subtree selects the whole field.
+    """
+    def parse(position):
+        tree = {}
+        while position < len(mask):
+            end = position
+            while end < len(mask) and mask[end] not in ',/()':
+                end += 1
+            name = mask[position:end].strip()
+            subtree = None
+            if end < len(mask) and mask[end] == '/':
+                subtree, end = parse_path(end + 1)
+            elif end < len(mask) and mask[end] == '(':
+                subtree, end = parse(end + 1)
+                end += 1  # Closing parenthesis
+            tree[name] = _merge_fields(tree[name], subtree) if name in tree else subtree
+            if end < len(mask) and mask[end] == ',':
+                position = end + 1
+            else:
+                return tree, end
+        return tree, position
+
+    def parse_path(position):
+        # a/b(c) selects b(c) inside a: parse a single field, without consuming the siblings of a
+        end = position
+        while end < len(mask) and mask[end] not in ',/()':
+            end += 1
+        name = mask[position:end].strip()
+        subtree = None
+        if end < len(mask) and mask[end] == '/':
+            subtree, end = parse_path(end + 1)
+        elif end < len(mask) and mask[end] == '(':
+            subtree, end = parse(end + 1)
+            end += 1
+        return {name: subtree}, end
+
+    return parse(0)[0]
+
+
+def _merge_fields(tree, other):
+    if tree is None or other is None:
+        return None
+    merged = dict(tree)
+    for name, subtree in other.items():
+        merged[name] = _merge_fields(merged[name], subtree) if name in merged else subtree
+    return merged
+
+
+def select_fields(value, tree):
+    """
+    Keep the fields of `value` selected by a tree returned by "parse_fields". Lists are filtered item by item.
+    """
+    if tree is None:
+        return value
+    if isinstance(value, list):
+        return [select_fields(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {name: select_fields(value[name], subtree) for name, subtree in tree.items() if name in value}
+    return value
+
+
+def _error_body(status, reason, message):
+    return {'error': {'code': status, 'message': message, 'errors': [{'reason': reason, 'message': message}]}}
+
+
+def _timestamp(seconds):
+    return (EPOCH + timedelta(seconds=seconds)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class FakeYouTubeData:
+    """
+    Deterministic synthetic dataset: channel c has videos 0..videos_per_channel-1, newest first,
+    and each video has comments_per_video comment threads, newest first.
+    """
+
+    def __init__(self, config):
+        self.config = config
+
+    def channel_id(self, c):
+        return f"UCfake{c:016d}"
+
+    def video_id(self, c, v):
+        return f"v{c:04d}x{v:06d}"
+
+    def parse_channel(self, channel_id):
+        if not channel_id.startswith('UCfake'):
+            return None
+        c = int(channel_id[6:])
+        return c if c < self.config['channels'] else None
+
+    def parse_video(self, video_id):
+        try:
+            c, v = int(video_id[1:5]), int(video_id[6:])
+        except ValueError:
+            return None
+        if c >= self.config['channels'] or v >= self.config['videos_per_channel']:
+            return None
+        return c, v
+
+    def video_published_at(self, c, v):
+        # Newest videos first in the uploads playlist
+        return _timestamp((self.config['videos_per_channel'] - v) * 86400 + c)
+
+    def channel(self, c):
+        channel_id = self.channel_id(c)
+        return {
+            'kind': 'youtube#channel',
+            'id': channel_id,
+            'snippet': {'title': f"Fake channel {c}", 'description': f"Synthetic channel number {c} " * 10},
+            'contentDetails': {'relatedPlaylists': {'uploads': 'UU' + channel_id[2:]}},
+            'statistics': {'viewCount': str(1000 * (c + 1)), 'subscriberCount': str(10 * (c + 1)),
+                           'videoCount': str(self.config['videos_per_channel'])},
+        }
+
+    def playlist_item(self, c, v):
+        return {
+            'kind': 'youtube#playlistItem',
+            'snippet': {'title': f"Video {v} of channel {c}", 'description': 'Lorem ipsum ' * 20},
+            'contentDetails': {'videoId': self.video_id(c, v), 'videoPublishedAt': self.video_published_at(c, v)},
+        }
+
+    def video(self, c, v):
+        return {
+            'kind': 'youtube#video',
+            'id': self.video_id(c, v),
+            'snippet': {'title': f"Video {v} of channel {c}", 'description': 'Lorem ipsum dolor sit amet. ' * 40,
+                        'publishedAt': self.video_published_at(c, v), 'tags': ['fake', 'benchmark']},
+            'contentDetails': {'duration': 'PT10M', 'definition': 'hd'},
+            'statistics': {'viewCount': str(100 * (v + 1)), 'likeCount': str(v + 1),
+                           'commentCount': str(self.config['comments_per_video'])},
+        }
+
+    def reply_count(self, t):
+        return self.config['replies_per_thread'] if t % self.config['reply_every'] == 0 else 0
+
+    def comment(self, video_id, comment_id, text, published_at, parent_id=None):
+        snippet = {
+            'videoId': video_id,
+            'textDisplay': text,
+            'textOriginal': text,
+            'authorDisplayName': '@fake-author',
+            'authorChannelId': {'value': 'UCauthor'},
+            'likeCount': len(text) % 7,
+            'publishedAt': published_at,
+            'updatedAt': published_at,
+        }
+        if parent_id:
+            snippet['parentId'] = parent_id
+        return {'kind': 'youtube#comment', 'id': comment_id, 'snippet': snippet}
+
+    def thread(self, c, v, t):
+        video_id = self.video_id(c, v)
+        thread_id = f"{video_id}.t{t:06d}"
+        # Newest threads first, all published after the video
+        published_at = _timestamp((self.config['videos_per_channel'] - v) * 86400 + 3600
+                                  + (self.config['comments_per_video'] - t) * 60)
+        replies = [self.reply(c, v, t, r) for r in range(min(INLINE_REPLIES, self.reply_count(t)))]
+        item = {
+            'kind': 'youtube#commentThread',
+            'id': thread_id,
+            'snippet': {
+                'videoId': video_id,
+                'topLevelComment': self.comment(video_id, thread_id, f"Comment {t} on video {video_id}, great content!", published_at),
+                'canReply': True,
+                'totalReplyCount': self.reply_count(t),
+                'isPublic': True,
+            },
+        }
+        if replies:
+            item['replies'] = {'comments': replies}
+        return item
+
+    def reply(self, c, v, t, r):
+        video_id = self.video_id(c, v)
+        thread_id = f"{video_id}.t{t:06d}"
+        published_at = _timestamp((self.config['videos_per_channel'] - v) * 86400 + 7200
+                                  + (self.config['comments_per_video'] - t) * 60 + r)
+        return self.comment(video_id, f"{thread_id}.r{r:04d}", f"Reply {r} to comment {t}, thanks!", published_at, thread_id)
+
+
+class FakeYouTubeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately: without TCP_NODELAY, every response waits for the delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        return self._send_payload(status, json.dumps(body).encode('utf-8'), 'application/json; charset=UTF-8')
+
+    def _send_payload(self, status, payload, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        # The real API only compresses for clients having "gzip" in their User-Agent
+        if 'gzip' in self.headers.get('Accept-Encoding', '') and 'gzip' in self.headers.get('User-Agent', ''):
+            payload = gzip.compress(payload, compresslevel=6)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        return len(payload)
+
+    def _error(self, status, reason, message):
+        return self._send_json(status, _error_body(status, reason, message))
+
+    def do_GET(self):
+        server = self.server
+        url = urlsplit(self.path)
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+
+        if url.path == '/_stats':
+            self._send_json(200, server.snapshot())
+            return
+
+        endpoint = url.path.rsplit('/', 1)[-1]
+        handler = getattr(self, f"_list_{endpoint}", None)
+        if handler is None:
+            self._error(404, 'notFound', f"Unknown endpoint {url.path}")
+            return
+
+        if server.config['latency']:
+            time.sleep(server.config['latency'])
+
+        status, response = self._answer(handler, params)
+        size = self._send_json(status, response)
+        server.record(f"{endpoint}.list", status, size)
+
+    def _answer(self, handler, params):
+        """
+        Returns the (status, body) of a list request, or of an injected error.
+        """
+        status = self.server.draw_error()
+        if status is not None:
+            return status, _error_body(status, ERROR_REASONS.get(status, 'backendError'), 'Injected error')
+        response = handler(params)
+        if params.get('fields'):
+            response = select_fields(response, parse_fields(params['fields']))
+        return 200, response
+
+    def do_POST(self):
+        """
+        Batch endpoint: a multipart/mixed body of application/http GET requests, answered in one multipart response.
+        """
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not urlsplit(self.path).path.endswith('/batch'):
+            self._error(404, 'notFound', f"Unknown endpoint {self.path}")
+            return
+
+        if server.config['latency']:
+            time.sleep(server.config['latency'])
+
+        message = BytesParser().parsebytes(f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode('utf-8') + body)
+        boundary = f"batch_{uuid.uuid4().hex}"
+        parts = []
+        for part in message.get_payload():
+            request_line = part.get_payload().lstrip().split('\n', 1)[0]
+            url = urlsplit(request_line.split(' ')[1])
+            params = {name: values[0] for name, values in parse_qs(url.query).items()}
+            endpoint = url.path.rsplit('/', 1)[-1]
+            handler = getattr(self, f"_list_{endpoint}", None)
+            if handler is None:
+                status, response = 404, _error_body(404, 'notFound', f"Unknown endpoint {url.path}")
+            else:
+                status, response = self._answer(handler, params)
+            payload = json.dumps(response)
+            server.record(f"{endpoint}.list", status, len(payload), batched=True)
+            content_id = part['Content-ID'].strip('<>')
+            parts.append(f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                         f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                         f"Content-Type: application/json; charset=UTF-8\r\n\r\n{payload}\r\n")
+        parts.append(f"--{boundary}--\r\n")
+
+        size = self._send_payload(200, ''.join(parts).encode('utf-8'), f"multipart/mixed; boundary={boundary}")
+        server.record('batch', 200, size)
+
+    def _page(self, total, params, default_size):
+        size = min(int(params.get('maxResults', default_size)), self.server.config['max_page_size'])
+        start = int(params.get('pageToken') or 0)
+        end = min(total, start + size)
+        return range(start, end), (str(end) if end < total else None)
+
+    def _list_response(self, kind, items, next_page_token=None, total=None):
+        response = {'kind': kind, 'pageInfo': {'totalResults': len(items) if total is None else total,
+                                               'resultsPerPage': len(items)}, 'items': items}
+        if next_page_token:
+            response['nextPageToken'] = next_page_token
+        return response
+
+    def _list_channels(self, params):
+        data = self.server.data
+        items = []
+        for channel_id in params.get('id', '').split(','):
+            c = data.parse_channel(channel_id)
+            if c is not None:
+                items.append(data.channel(c))
+        return self._list_response('youtube#channelListResponse', items)
+
+    def _list_playlistItems(self, params):
+        data = self.server.data
+        c = data.parse_channel('UC' + params.get('playlistId', '')[2:])
+        if c is None:
+            return self._list_response('youtube#playlistItemListResponse', [])
+        rows, next_page_token = self._page(data.config['videos_per_channel'], params, 5)
+        return self._list_response('youtube#playlistItemListResponse', [data.playlist_item(c, v) for v in rows],
+                                   next_page_token, data.config['videos_per_channel'])
+
+    def _list_videos(self, params):
+        data = self.server.data
+        items = []
+        for video_id in params.get('id', '').split(','):
+            parsed = data.parse_video(video_id)
+            if parsed is not None:
+                items.append(data.video(*parsed))
+        return self._list_response('youtube#videoListResponse', items)
+
+    def _list_commentThreads(self, params):
+        data = self.server.data
+        parsed = data.parse_video(params.get('videoId', ''))
+        if parsed is None:
+            return self._list_response('youtube#commentThreadListResponse', [])
+        rows, next_page_token = self._page(data.config['comments_per_video'], params, 20)
+        return self._list_response('youtube#commentThreadListResponse', [data.thread(*parsed, t) for t in rows],
+                                   next_page_token)
+
+    def _list_comments(self, params):
+        data = self.server.data
+        thread_id = params.get('parentId', '')
+        video_id, _, thread = thread_id.partition('.t')
+        parsed = data.parse_video(video_id)
+        if parsed is None or not thread.isdigit():
+            return self._list_response('youtube#commentListResponse', [])
+        t = int(thread)
+        rows, next_page_token = self._page(data.reply_count(t), params, 20)
+        return self._list_response('youtube#commentListResponse', [data.reply(*parsed, t, r) for r in rows],
+                                   next_page_token)
+
+
+class FakeYouTubeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, FakeYouTubeHandler)
+        self.config = config
+        self.data = FakeYouTubeData(config)
+        self.random = random.Random(config['seed'])
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def draw_error(self):
+        """
+        Returns the status of an injected error, or None to answer normally.
+        """
+        with self.lock:
+            if self.config['error_rate'] and self.random.random() < self.config['error_rate']:
+                return self.random.choice(self.config['error_statuses'])
+        return None
+
+    def record(self, endpoint, status, size, batched=False):
+        """
+        Count a request. The sub-requests of a batch are counted as `batched` rather than as requests,
+        their bytes being sent with the batch.
+        """
+        with self.lock:
+            stats = self.stats.setdefault(endpoint, {'requests': 0, 'batched': 0, 'errors': 0, 'bytes': 0})
+            if batched:
+                stats['batched'] += 1
+            else:
+                stats['requests'] += 1
+                stats['bytes'] += size
+            if status != 200:
+                stats['errors'] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return json.loads(json.dumps(self.stats))
+
+
+def serve(port, config):
+    """
+    Serve the fake API on 127.0.0.1:`port` until the process is terminated.
+    """
+    FakeYouTubeServer(('127.0.0.1', port), dict(DEFAULT_CONFIG, **config)).serve_forever()
+
+
+def fetch_stats(url):
+    """
+    Returns the per-endpoint counters ('requests', 'batched' sub-requests, 'errors', 'bytes' sent on the wire)
+    of a running fake API.
+    """
+    with urllib.request.urlopen(f"{url}_stats") as response:
+        return json.loads(response.read())
+
+
+def start_in_process(port, **config):
+    """
+    Start the fake API in a separate process, so that it does not weigh on the measured process.
+
+    Returns:
+        tuple: (process, url), terminate the process to stop the server.
+    """
+    process = multiprocessing.Process(target=serve, args=(port, config), daemon=True)
+    process.start()
+
+    url = f"http://127.0.0.1:{port}/"
+    for _ in range(100):
+        try:
+            fetch_stats(url)
+            break
+        except OSError:
+            time.sleep(0.05)
+    return process, url
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--channels', type=int, default=DEFAULT_CONFIG['channels'])
+    parser.add_argument('--videos', type=int, default=DEFAULT_CONFIG['videos_per_channel'])
+    parser.add_argument('--comments', type=int, default=DEFAULT_CONFIG['comments_per_video'])
+    parser.add_argument('--latency', type=float, default=DEFAULT_CONFIG['latency'])
+    parser.add_argument('--error-rate', type=float, default=DEFAULT_CONFIG['error_rate'])
+    args = parser.parse_args()
+
+    serve(args.port, {'channels': args.channels, 'videos_per_channel': args.videos,
+                      'comments_per_video': args.comments, 'latency': args.latency, 'error_rate': args.error_rate})
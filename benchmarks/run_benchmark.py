@@ -0,0 +1,221 @@
+"""
+Offline benchmark of the pipeline against a local fake YouTube Data API and a local S3 stand-in.
+
+Runs get_channel_info, get_videos_info, get_video_comments and the S3 upload of the comments, and reports
+for each stage: wall time, API/S3 requests, quota units, peak RSS and records per second.
+
+    python -m benchmarks.run_benchmark --channels 5 --videos 200 --comments 50 --latency 0.02 --workers 8
+
+With --baseline, the run is compared to a previous --json report and the exit code is 1 if a stage got
+slower (or spent more requests or quota) by more than --max-regression.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+
+from benchmarks import fake_s3, fake_youtube_api
+
+BUCKET = 'benchmark-bucket'
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _api_requests(stats):
+    # HTTP exchanges: a batch counts once, whatever the number of sub-requests
+    return sum(endpoint['requests'] for endpoint in stats.values())
+
+
+def _s3_requests(stats):
+    return sum(stats['requests'].values())
+
+
+def configure_environment(api_url, s3_url):
+    """
+    Point the pipeline to the stand-ins. Must run before youtube_api_requests is imported.
+    """
+    os.environ.update({
+        'API_KEY_YOUTUBE_API': 'benchmark',
+        'YOUTUBE_API_ENDPOINT': api_url,
+        'YOUTUBE_DAILY_QUOTA': str(10 ** 9),
+        'YOUTUBE_REQUESTS_PER_SECOND': str(10 ** 6),
+        'S3_ENDPOINT_URL': s3_url,
+        'AWS_ACCESS_KEY_ID': 'benchmark',
+        'AWS_SECRET_ACCESS_KEY': 'benchmark',
+        'AWS_DEFAULT_REGION': 'us-east-1',
+    })
+    os.environ.pop('YOUTUBE_RESPONSE_CACHE', None)
+
+
+def run(args):
+    """
+    Start the stand-ins, run the pipeline stages against them and return the report.
+    """
+    api_process, api_url = fake_youtube_api.start_in_process(
+        args.api_port, channels=args.channels, videos_per_channel=args.videos, comments_per_video=args.comments,
+        replies_per_thread=args.replies, latency=args.latency, error_rate=args.error_rate,
+        error_statuses=args.error_statuses)
+    s3_process, s3_url = fake_s3.start_in_process(args.s3_port)
+
+    try:
+        configure_environment(api_url, s3_url)
+
+        import youtube_api_requests as ytapi
+        from metrics import run_metrics
+        from s3_upload import create_s3_client, upload_records
+
+        data = fake_youtube_api.FakeYouTubeData(dict(fake_youtube_api.DEFAULT_CONFIG, channels=args.channels))
+        channel_ids = [data.channel_id(c) for c in range(args.channels)]
+        s3 = run_metrics.instrument_s3_client(create_s3_client())
+        s3.create_bucket(Bucket=BUCKET)
+
+        stages = [
+            ('channels', lambda _: ytapi.get_channel_info(channel_ids, as_records=args.records)),
+            ('videos', lambda channels: ytapi.get_videos_info(channels, max_workers=args.workers,
+                                                              as_records=args.records)),
+            ('comments', lambda videos: ytapi.get_video_comments(videos, max_workers=args.workers,
+                                                                 as_records=args.records, batch_size=args.batch_size)),
+            ('upload', lambda comments: [upload_records(comments, BUCKET, 'videos_comments.ndjson', s3=s3,
+                                                        compression=args.compression)]),
+        ]
+        if args.pipeline:
+            stages = [('pipeline', lambda _: run_pipeline(ytapi, channel_ids, s3, upload_records, args))]
+
+        report = {'config': vars(args), 'stages': {}}
+        previous = None
+        for name, stage in stages:
+            api_before = _api_requests(fake_youtube_api.fetch_stats(api_url))
+            s3_before = _s3_requests(fake_s3.fetch_stats(s3_url))
+            quota_before = ytapi.scheduler.units_spent
+            records_in = len(previous) if previous is not None else 0
+
+            start = time.perf_counter()
+            result = stage(previous)
+            wall_time = time.perf_counter() - start
+
+            if name == 'pipeline':
+                records = result
+            else:
+                records = records_in if name == 'upload' else len(result)
+            report['stages'][name] = {
+                'wall_time_s': round(wall_time, 3),
+                'records': records,
+                'records_per_s': round(records / wall_time, 1) if wall_time else None,
+                'api_requests': _api_requests(fake_youtube_api.fetch_stats(api_url)) - api_before,
+                's3_requests': _s3_requests(fake_s3.fetch_stats(s3_url)) - s3_before,
+                'quota_units': ytapi.scheduler.units_spent - quota_before,
+                'peak_rss_mb': round(_peak_rss_mb(), 1),
+            }
+            if name != 'upload':
+                previous = result
+
+        report['run_metrics'] = run_metrics.summary()
+        report['api'] = fake_youtube_api.fetch_stats(api_url)
+        report['s3'] = fake_s3.fetch_stats(s3_url)
+        report['total_wall_time_s'] = round(sum(stage['wall_time_s'] for stage in report['stages'].values()), 3)
+        return report
+
+    finally:
+        api_process.terminate()
+        s3_process.terminate()
+
+
+def run_pipeline(ytapi, channel_ids, s3, upload_records, args):
+    """
+    Run all the stages at once with pipeline.Pipeline, returning the number of comments uploaded.
+    """
+    from pipeline import Pipeline
+
+    count = [0]
+
+    def counted(comments):
+        for comment in comments:
+            count[0] += 1
+            yield comment
+
+    pipeline = Pipeline(channel_ids, max_workers=args.workers, batch_size=args.batch_size, as_records=args.records)
+    pipeline.run(lambda comments: upload_records(counted(comments), BUCKET, 'videos_comments.ndjson', s3=s3,
+                                                 compression=args.compression))
+    return count[0]
+
+
+def print_report(report):
+    columns = ('wall_time_s', 'records', 'records_per_s', 'api_requests', 's3_requests', 'quota_units', 'peak_rss_mb')
+    print(f"{'stage':<10}" + ''.join(f"{column:>15}" for column in columns))
+    for name, stage in report['stages'].items():
+        print(f"{name:<10}" + ''.join(f"{str(stage[column]):>15}" for column in columns))
+    print(f"total wall time: {report['total_wall_time_s']} s")
+    for key, stored in report['s3']['objects'].items():
+        print(f"uploaded {key}: {stored['size']} bytes ({stored.get('Content-Encoding', 'identity')})")
+
+
+def compare(report, baseline, max_regression):
+    """
+    Returns the list of regressions of `report` against `baseline`, a previous report.
+    """
+    ignored = {'json', 'baseline', 'max_regression', 'api_port', 's3_port'}
+    changed = [name for name, value in report['config'].items()
+               if name not in ignored and baseline.get('config', {}).get(name) != value]
+    if changed:
+        print(f"WARNING: the baseline was run with different settings: {', '.join(changed)}")
+
+    regressions = []
+    for name, stage in report['stages'].items():
+        reference = baseline.get('stages', {}).get(name)
+        if reference is None:
+            continue
+        for metric in ('wall_time_s', 'api_requests', 'quota_units'):
+            if reference[metric] and stage[metric] > reference[metric] * (1 + max_regression):
+                regressions.append(f"{name}.{metric}: {reference[metric]} -> {stage[metric]}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--channels', type=int, default=3)
+    parser.add_argument('--videos', type=int, default=100, help='videos per channel')
+    parser.add_argument('--comments', type=int, default=30, help='comment threads per video')
+    parser.add_argument('--replies', type=int, default=2, help='replies of the threads having replies')
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds added to every API response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability of an injected API error')
+    parser.add_argument('--error-statuses', type=int, nargs='+', default=[500], help='statuses of the injected errors')
+    parser.add_argument('--workers', type=int, default=1, help='max_workers of the pipeline')
+    parser.add_argument('--batch-size', type=int, default=None,
+                        help='coalesce the first comment pages of this many videos per batch request')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='run the stages concurrently with pipeline.Pipeline instead of one after the other')
+    parser.add_argument('--records', action='store_true', help='keep the records as slotted objects instead of dicts')
+    parser.add_argument('--compression', default='gzip', choices=['gzip', 'zstd', 'none'])
+    parser.add_argument('--api-port', type=int, default=8089)
+    parser.add_argument('--s3-port', type=int, default=8090)
+    parser.add_argument('--json', help='write the report to this file')
+    parser.add_argument('--baseline', help='previous JSON report to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    args = parser.parse_args(argv)
+    if args.compression == 'none':
+        args.compression = None
+
+    report = run(args)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(report, json_file, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as json_file:
+            regressions = compare(report, json.load(json_file), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,59 @@
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = 'channel_cache.json'
+DEFAULT_TTL = 7 * 24 * 3600  # One week, the uploads playlist ID of a channel never changes
+
+
+class ChannelCache:
+    """
+    Local JSON file caching the channel information returned by "get_channel_info", keyed by channel ID.
+
+    Entries older than `ttl` seconds are considered stale and are fetched again from the API. The statistics
+    of a cached channel (viewcount, subscribers, videocount) are those of when it was fetched.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL):
+        """
+        Params:
+            path (str): The path of the JSON file backing the cache. It is created on the first save.
+            ttl (int): The number of seconds a cached channel stays valid.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.entries = {}
+
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as json_file:
+                    self.entries = json.load(json_file)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"Ignoring unreadable channel cache {path}: {e}")
+
+    def get(self, channel_id):
+        """
+        Returns the cached information of a channel, or None if it is missing or expired.
+        """
+        entry = self.entries.get(channel_id)
+        if entry is None or time.time() - entry.get('fetched_at', 0) > self.ttl:
+            return None
+        return entry.get('info')
+
+    def put(self, channel_id, channel_info):
+        """
+        Stores the information of a channel, stamped with the current time.
+        """
+        self.entries[channel_id] = {'fetched_at': time.time(), 'info': channel_info}
+
+    def save(self):
+        """
+        Writes the cache to disk. The file is replaced atomically so that a crash never leaves it truncated.
+        """
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as json_file:
+            json.dump(self.entries, json_file)
+        os.replace(tmp_path, self.path)
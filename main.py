@@ -1,7 +1,14 @@
 import youtube_api_requests as ytapi
-import boto3
+from channel_cache import ChannelCache
+from sync_state import SyncState
+from pipeline import Pipeline
+from s3_upload import create_s3_client, upload_records
+from metrics import run_metrics
+from parquet_export import s3_filesystem, write_videos_parquet, write_comments_parquet
 from botocore.exceptions import NoCredentialsError
 import json
+import os
+from datetime import datetime, timezone
 
 channel_ids = ['UCtYLUTtgS3k1Fg4y5tAhLbw', # Statquest
                'UCCezIgC97PvUuR4_gbFUs5g', # Corey Schafer
@@ -12,49 +19,120 @@ channel_ids = ['UCtYLUTtgS3k1Fg4y5tAhLbw', # Statquest
                'UC2UXDak6o7rBm23k3Vv5dww', # Tina Huang
               ]
 
-# Get channels_infos
-channel_infos = ytapi.get_channel_info(channel_ids)
-# Get videos_info
-videos_info = ytapi.get_videos_info(channel_infos)
-# Get comments
-videos_comments = ytapi.get_video_comments(videos_info)
+# Number of concurrent API workers, each with its own client
+max_workers = int(os.getenv('YOUTUBE_MAX_WORKERS', '1'))
+# Number of videos whose first comment page is requested in a single batch HTTP exchange, 0 to disable batching
+comments_batch_size = int(os.getenv('YOUTUBE_COMMENTS_BATCH_SIZE', '0'))
+# In pipelined mode, the channels, videos, comments and the upload are processed concurrently instead of one after the other
+pipelined = os.getenv('YOUTUBE_PIPELINE', '0') == '1'
 
-# Initialize the S3 resource
-s3 = boto3.client('s3')
+# Get channels_infos. With CHANNEL_CACHE_TTL, the channels fetched by the previous runs are reused,
+# statistics included: channel_info.json then holds counts up to CHANNEL_CACHE_TTL seconds old
+channel_cache_ttl = int(os.getenv('CHANNEL_CACHE_TTL', '0'))
+channel_cache = ChannelCache(ttl=channel_cache_ttl) if channel_cache_ttl > 0 else None
+# Get videos_info. In incremental mode, only the videos published since the last run and the latest
+# known videos are fetched, based on the high-watermarks kept in sync_state.json
+incremental = os.getenv('YOUTUBE_INCREMENTAL', '0') == '1'
+# In comment delta mode, only the comments posted since the last run are fetched, for the videos whose
+# comment count changed, and they are appended to S3 as a new partition
+comments_delta = os.getenv('YOUTUBE_COMMENTS_DELTA', '0') == '1'
+sync_state = SyncState() if incremental or comments_delta else None
+recent_count = int(os.getenv('YOUTUBE_RECENT_VIDEOS', ytapi.DEFAULT_RECENT_VIDEOS))
+if pipelined:
+    pipeline = Pipeline(channel_ids, max_workers=max_workers, cache=channel_cache,
+                        state=sync_state if incremental else None, comments_state=sync_state if comments_delta else None,
+                        recent_count=recent_count, batch_size=comments_batch_size)
+    # Filled as the pipeline runs, below
+    channel_infos, videos_info = pipeline.channels, pipeline.videos
+else:
+    channel_infos = ytapi.get_channel_info(channel_ids, cache=channel_cache)
+    videos_info = ytapi.get_videos_info(channel_infos, max_workers=max_workers, state=sync_state if incremental else None,
+                                        recent_count=recent_count)
+# Initialize the S3 resource, every call it makes is recorded in the run metrics
+s3 = run_metrics.instrument_s3_client(create_s3_client())
 
 # List all buckets (for verification)
-s3_resource = boto3.resource('s3')
-for bucket in s3_resource.buckets.all():
-    print(bucket.name)
+for bucket in s3.list_buckets().get('Buckets', []):
+    print(bucket['Name'])
 
 # Set the bucket name and object name
 bucket_name = 'ana-airflow-youtube-api'
 
+# Get comments, streamed page by page to S3, either as compressed newline-delimited JSON in parallel multipart
+# parts, or as typed Parquet datasets partitioned by channel (videos) and channel/video/date (comments)
+output_format = os.getenv('OUTPUT_FORMAT', 'ndjson')
+comments_state = sync_state if comments_delta else None
+run_at = datetime.now(timezone.utc)
+comments_key = 'videos_comments.ndjson'
+if comments_delta:
+    # Each delta is a new object, and is appended to the Parquet dataset
+    comments_key = f"comments/dt={run_at:%Y-%m-%d}/videos_comments-{run_at:%H%M%S}.ndjson"
+# The sync state is only saved if every upload succeeded, so that a failed run is fetched again
+upload_failed = False
+try:
+    if pipelined and output_format == 'parquet':
+        parquet_fs = run_metrics.instrument_filesystem(s3_filesystem())
+        pipeline.run(lambda comments: write_comments_parquet(comments, [], f"{bucket_name}/parquet/comments",
+                                                             filesystem=parquet_fs,
+                                                             channel_by_video=pipeline.channel_by_video,
+                                                             append=comments_delta, snapshot_at=run_at))
+        write_videos_parquet(videos_info, f"{bucket_name}/parquet/videos", filesystem=parquet_fs,
+                             append=incremental, snapshot_at=run_at)
+        print(f"Parquet data uploaded to '{bucket_name}' under 'parquet/'.")
+    elif pipelined:
+        object_name_videos_comments = pipeline.run(
+            lambda comments: upload_records(comments, bucket_name, comments_key, s3=s3,
+                                            compression=os.getenv('S3_COMPRESSION', 'gzip') or None))
+        print(f"NDJSON data uploaded to '{bucket_name}' as '{object_name_videos_comments}'.")
+    elif output_format == 'parquet':
+        parquet_fs = run_metrics.instrument_filesystem(s3_filesystem())
+        # Full exports replace the partitions they write, incremental ones are appended
+        write_videos_parquet(videos_info, f"{bucket_name}/parquet/videos", filesystem=parquet_fs,
+                             append=incremental, snapshot_at=run_at)
+        write_comments_parquet(ytapi.iter_video_comments(videos_info, max_workers=max_workers,
+                                                         batch_size=comments_batch_size, state=comments_state), videos_info,
+                               f"{bucket_name}/parquet/comments", filesystem=parquet_fs,
+                               append=comments_delta, snapshot_at=run_at)
+        print(f"Parquet data uploaded to '{bucket_name}' under 'parquet/'.")
+    else:
+        object_name_videos_comments = upload_records(ytapi.iter_video_comments(videos_info, max_workers=max_workers,
+                                                                               batch_size=comments_batch_size,
+                                                                               state=comments_state),
+                                                     bucket_name, comments_key, s3=s3,
+                                                     compression=os.getenv('S3_COMPRESSION', 'gzip') or None)
+        print(f"NDJSON data uploaded to '{bucket_name}' as '{object_name_videos_comments}'.")
+except NoCredentialsError:
+    upload_failed = True
+    print("Credentials not available.")
+except Exception as e:
+    upload_failed = True
+    print(f"An error occurred: {str(e)}")
+
 # Convert the channel info to a JSON string
 channel_info_json = json.dumps(channel_infos, indent=4)  # Use json.dumps to get a JSON string
 videos_info_json = json.dumps(videos_info, indent=4) 
-videos_comments_json = json.dumps(videos_comments, indent=4) 
 
 object_name_channel_info = 'channel_info.json'
 object_name_videos_info = 'videos_info.json'
-object_name_videos_comments = 'videos_comments.json'
+if incremental:
+    # An incremental run only holds the new and latest videos: keep the full listings of the previous runs
+    object_name_videos_info = f"videos/dt={run_at:%Y-%m-%d}/videos_info-{run_at:%H%M%S}.json"
 
 with open(object_name_channel_info, 'w') as json_file:
-    json.dump(channel_info_json, json_file, indent=4) 
-
-with open(object_name_videos_info, 'w') as json_file:
-    json.dump(videos_info_json, json_file, indent=4) 
+    json_file.write(channel_info_json)
 
-with open(object_name_videos_comments, 'w') as json_file:
-    json.dump(videos_comments_json, json_file, indent=4) 
+with open('videos_info.json', 'w') as json_file:
+    json_file.write(videos_info_json)
 
 try:
     # Upload the JSON string to S3
     s3.put_object(Bucket=bucket_name, Key=object_name_channel_info, Body=channel_info_json, ContentType='application/json')
     print(f"JSON data uploaded to '{bucket_name}' as '{object_name_channel_info}'.")
 except NoCredentialsError:
+    upload_failed = True
     print("Credentials not available.")
 except Exception as e:
+    upload_failed = True
     print(f"An error occurred: {str(e)}")
 
 try:
@@ -62,16 +140,17 @@ try:
     s3.put_object(Bucket=bucket_name, Key=object_name_videos_info, Body=videos_info_json, ContentType='application/json')
     print(f"JSON data uploaded to '{bucket_name}' as '{object_name_videos_info}'.")
 except NoCredentialsError:
+    upload_failed = True
     print("Credentials not available.")
 except Exception as e:
+    upload_failed = True
     print(f"An error occurred: {str(e)}")
 
-try:
-    # Upload the JSON string to S3
-    s3.put_object(Bucket=bucket_name, Key=object_name_videos_comments, Body=videos_comments_json, ContentType='application/json')
-    print(f"JSON data uploaded to '{bucket_name}' as '{object_name_videos_comments}'.")
-except NoCredentialsError:
-    print("Credentials not available.")
-except Exception as e:
-    print(f"An error occurred: {str(e)}")
+# Everything is stored: the next incremental run and comment delta start from here
+if sync_state is not None and not upload_failed:
+    sync_state.save()
 
+# Emit the metrics of the run: per-endpoint latency histograms, bytes, retries, quota units and errors
+run_metrics.write_json(os.getenv('RUN_METRICS_PATH', 'run_metrics.json'))
+if os.getenv('METRICS_PROMETHEUS_TEXTFILE'):
+    run_metrics.write_prometheus(os.getenv('METRICS_PROMETHEUS_TEXTFILE'))
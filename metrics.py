@@ -0,0 +1,453 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+# Upper bounds of the pages per video histogram buckets
+PAGES_BUCKETS = (1, 2, 5, 10, 20, 50, 100, float('inf'))
+
+UNATTRIBUTED = '(none)'
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram, in the Prometheus layout: per-bucket counts, plus the sum and count of the observations.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+        self.max = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """
+        Estimate a quantile as the upper bound of the bucket that contains it.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound if bound != float('inf') else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'mean': round(self.sum / self.count, 6) if self.count else None,
+            'max': round(self.max, 6),
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'buckets': {_bucket_label(bound): count for bound, count in zip(self.buckets, self.counts)},
+        }
+
+
+def _bucket_label(bound):
+    return '+Inf' if bound == float('inf') else f"{bound:g}"
+
+
+class _OperationStats:
+    """
+    Counters of one API endpoint or S3 operation.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        # Time spent before the request was sent: quota, rate limit and backoff waits
+        self.wait = Histogram(LATENCY_BUCKETS)
+        self.bytes = 0
+        self.retries = 0
+        self.quota_units = 0
+        self.cache_hits = 0
+        self.errors = {}
+
+    def to_dict(self, bytes_name):
+        stats = {
+            'calls': self.calls,
+            'cache_hits': self.cache_hits,
+            bytes_name: self.bytes,
+            'retries': self.retries,
+            'quota_units': self.quota_units,
+            'errors': dict(self.errors),
+            'latency_s': self.latency.to_dict(),
+        }
+        if self.wait.count:
+            stats['wait_s'] = self.wait.to_dict()
+        return stats
+
+
+class RunMetrics:
+    """
+    Thread-safe metrics of a run: latency histograms, bytes, retries, quota units and error classes of each
+    API endpoint and S3 operation, pages fetched per video, and quota units per channel.
+
+    The API latency only covers the HTTP exchanges, so that it can be used to size the concurrency. The time spent
+    waiting for the quota, the rate limit and the retry backoffs is recorded apart in the wait histogram.
+
+    The quota units are attributed to the label set with "scope" in the calling thread, e.g. the channel being processed.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started_at = time.time()
+        self.api = {}
+        self.s3 = {}
+        self.pages_per_video = {}
+        self.quota_by_scope = {}
+
+    @contextmanager
+    def scope(self, label):
+        """
+        Attribute the quota units spent by the current thread inside the block to `label`.
+        """
+        previous = getattr(self.local, 'scope', None)
+        self.local.scope = label
+        try:
+            yield
+        finally:
+            self.local.scope = previous
+
+    def record_api_call(self, endpoint, latency, response_bytes=0, retries=0, quota_units=0, error=None, cache_hit=False,
+                        wait=0):
+        """
+        Record one call to the YouTube API.
+
+        Params:
+            endpoint (str): The endpoint name, e.g. 'videos.list'.
+            latency (float): The duration of the HTTP exchanges of the call in seconds, its retries included.
+            response_bytes (int): The size of the decoded response body. The bytes on the wire are fewer,
+                                  the responses being gzip-compressed.
+            retries (int): The number of retries of the call.
+            quota_units (int): The quota units spent by the call.
+            error (str): The error class if the call failed, e.g. 'HttpError 403 commentsDisabled'.
+            cache_hit (bool): Whether the response came from the response cache.
+            wait (float): The time in seconds the call waited for the quota, the rate limit and the retry backoffs.
+        """
+        with self.lock:
+            stats = self.api.setdefault(endpoint, _OperationStats())
+            if cache_hit:
+                stats.cache_hits += 1
+                return
+            stats.calls += 1
+            stats.latency.observe(latency)
+            stats.wait.observe(wait)
+            stats.bytes += response_bytes
+            stats.retries += retries
+            stats.quota_units += quota_units
+            if error:
+                stats.errors[error] = stats.errors.get(error, 0) + 1
+
+            label = getattr(self.local, 'scope', None) or UNATTRIBUTED
+            self.quota_by_scope[label] = self.quota_by_scope.get(label, 0) + quota_units
+
+    def record_pages(self, resource, pages):
+        """
+        Record the number of pages fetched for one video, e.g. resource='commentThreads'.
+        """
+        with self.lock:
+            self.pages_per_video.setdefault(resource, Histogram(PAGES_BUCKETS)).observe(pages)
+
+    def record_s3_call(self, operation, latency, bytes_sent=0, retries=0, error=None):
+        """
+        Record one S3 call, e.g. operation='UploadPart'.
+        """
+        with self.lock:
+            stats = self.s3.setdefault(operation, _OperationStats())
+            stats.calls += 1
+            stats.latency.observe(latency)
+            stats.bytes += bytes_sent
+            stats.retries += retries
+            if error:
+                stats.errors[error] = stats.errors.get(error, 0) + 1
+
+    def instrument_s3_client(self, s3):
+        """
+        Record every call made by a boto3 S3 client, through the botocore event hooks.
+        """
+        def before_parameter_build(params, model, context, **kwargs):
+            context['metrics_operation'] = model.name
+            context['metrics_bytes_sent'] = _body_size(params.get('Body'))
+
+        def before_call(context, **kwargs):
+            context['metrics_started_at'] = time.perf_counter()
+
+        def after_call(http_response, parsed, model, context, **kwargs):
+            retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+            error = parsed.get('Error', {}).get('Code') if http_response.status_code >= 300 else None
+            self._record_s3_event(model.name, context, retries, error)
+
+        def after_call_error(exception, context, **kwargs):
+            self._record_s3_event(context.get('metrics_operation', 'unknown'), context, 0, type(exception).__name__)
+
+        s3.meta.events.register('before-parameter-build.s3', before_parameter_build)
+        s3.meta.events.register('before-call.s3', before_call)
+        s3.meta.events.register('after-call.s3', after_call)
+        s3.meta.events.register('after-call-error.s3', after_call_error)
+        return s3
+
+    def instrument_filesystem(self, filesystem):
+        """
+        Record every call made through a pyarrow filesystem, e.g. the S3 filesystem of the Parquet export,
+        which does not go through boto3. Returns a filesystem wrapping `filesystem`, to be used in its place.
+
+        The calls are recorded as S3 operations prefixed with 'parquet.'. The pyarrow S3 client uploads the parts
+        of an object in the background while it is written: the latency of 'parquet.PutObject' is the time
+        closing the object took, i.e. uploading its last part and completing the upload.
+        """
+        from pyarrow import fs
+        return fs.PyFileSystem(_metered_handler_class()(filesystem, self))
+
+    def _record_s3_event(self, operation, context, retries, error):
+        started_at = context.get('metrics_started_at')
+        latency = time.perf_counter() - started_at if started_at else 0
+        self.record_s3_call(operation, latency, context.get('metrics_bytes_sent', 0), retries, error)
+
+    def summary(self):
+        """
+        Returns the metrics of the run as a JSON-serializable dictionary.
+        """
+        with self.lock:
+            return {
+                'started_at': self.started_at,
+                'duration_s': round(time.time() - self.started_at, 3),
+                'api': {endpoint: stats.to_dict('response_bytes') for endpoint, stats in self.api.items()},
+                'api_totals': {
+                    'calls': sum(stats.calls for stats in self.api.values()),
+                    'cache_hits': sum(stats.cache_hits for stats in self.api.values()),
+                    'response_bytes': sum(stats.bytes for stats in self.api.values()),
+                    'quota_units': sum(stats.quota_units for stats in self.api.values()),
+                },
+                'pages_per_video': {resource: histogram.to_dict() for resource, histogram in self.pages_per_video.items()},
+                'quota_units_by_channel': dict(sorted(self.quota_by_scope.items(), key=lambda item: -item[1])),
+                's3': {operation: stats.to_dict('bytes_sent') for operation, stats in self.s3.items()},
+            }
+
+    def write_json(self, path):
+        """
+        Write the summary of the run to a JSON file.
+        """
+        with open(path, 'w') as json_file:
+            json.dump(self.summary(), json_file, indent=4)
+        logger.info(f"Run metrics written to {path}")
+
+    def write_prometheus(self, path):
+        """
+        Write the metrics in the Prometheus text format, for the node_exporter textfile collector.
+        The file is replaced atomically so that the collector never reads a partial file.
+        """
+        lines = []
+
+        def histogram_lines(name, labels, histogram):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{_bucket_label(bound)}"}} {cumulative}')
+            lines.append(f'{name}_sum{{{labels}}} {histogram.sum}')
+            lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+
+        with self.lock:
+            api_counters = (('response_bytes_total', 'bytes'), ('retries_total', 'retries'),
+                            ('quota_units_total', 'quota_units'), ('cache_hits_total', 'cache_hits'))
+            s3_counters = (('bytes_sent_total', 'bytes'), ('retries_total', 'retries'))
+            for prefix, operations, label_name, counters in (('youtube_api', self.api, 'endpoint', api_counters),
+                                                             ('s3', self.s3, 'operation', s3_counters)):
+                lines.append(f'# TYPE {prefix}_request_duration_seconds histogram')
+                for operation, stats in operations.items():
+                    histogram_lines(f'{prefix}_request_duration_seconds', f'{label_name}="{operation}"', stats.latency)
+                if prefix == 'youtube_api':
+                    lines.append('# TYPE youtube_api_wait_seconds histogram')
+                    for operation, stats in operations.items():
+                        histogram_lines('youtube_api_wait_seconds', f'{label_name}="{operation}"', stats.wait)
+                for metric, attribute in counters:
+                    lines.append(f'# TYPE {prefix}_{metric} counter')
+                    for operation, stats in operations.items():
+                        lines.append(f'{prefix}_{metric}{{{label_name}="{operation}"}} {getattr(stats, attribute)}')
+                lines.append(f'# TYPE {prefix}_errors_total counter')
+                for operation, stats in operations.items():
+                    for error, count in stats.errors.items():
+                        lines.append(f'{prefix}_errors_total{{{label_name}="{operation}",error="{_escape_label(error)}"}} {count}')
+
+            lines.append('# TYPE youtube_api_pages_per_video histogram')
+            for resource, histogram in self.pages_per_video.items():
+                histogram_lines('youtube_api_pages_per_video', f'resource="{resource}"', histogram)
+
+            lines.append('# TYPE youtube_api_channel_quota_units_total counter')
+            for label, units in self.quota_by_scope.items():
+                lines.append(f'youtube_api_channel_quota_units_total{{channel="{_escape_label(label)}"}} {units}')
+
+            lines.append('# TYPE youtube_pipeline_last_run_timestamp_seconds gauge')
+            lines.append(f'youtube_pipeline_last_run_timestamp_seconds {time.time()}')
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as prom_file:
+            prom_file.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
+        logger.info(f"Prometheus metrics written to {path}")
+
+
+_MeteredHandler = None
+
+
+def _metered_handler_class():
+    """
+    Returns the pyarrow FileSystemHandler recording the calls of a wrapped filesystem, defined on first use
+    since pyarrow is only needed for the Parquet export.
+    """
+    global _MeteredHandler
+    if _MeteredHandler is not None:
+        return _MeteredHandler
+
+    from pyarrow import PythonFile, fs
+
+    class MeteredHandler(fs.FileSystemHandler):
+        def __init__(self, filesystem, metrics):
+            self.fs = filesystem
+            self.metrics = metrics
+
+        def _call(self, operation, func, *args, **kwargs):
+            started_at = time.perf_counter()
+            error = None
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                self.metrics.record_s3_call(f"parquet.{operation}", time.perf_counter() - started_at, error=error)
+
+        def get_type_name(self):
+            return f"metered+{self.fs.type_name}"
+
+        def normalize_path(self, path):
+            return self.fs.normalize_path(path)
+
+        def get_file_info(self, paths):
+            return self._call('GetFileInfo', self.fs.get_file_info, paths)
+
+        def get_file_info_selector(self, selector):
+            return self._call('ListObjects', self.fs.get_file_info, selector)
+
+        def create_dir(self, path, recursive):
+            self._call('CreateDir', self.fs.create_dir, path, recursive=recursive)
+
+        def delete_dir(self, path):
+            self._call('DeleteDir', self.fs.delete_dir, path)
+
+        def delete_dir_contents(self, path, missing_dir_ok=False):
+            self._call('DeleteDirContents', self.fs.delete_dir_contents, path, missing_dir_ok=missing_dir_ok)
+
+        def delete_root_dir_contents(self):
+            self._call('DeleteDirContents', self.fs.delete_dir_contents, '/', accept_root_dir=True)
+
+        def delete_file(self, path):
+            self._call('DeleteObject', self.fs.delete_file, path)
+
+        def move(self, src, dest):
+            self._call('Move', self.fs.move, src, dest)
+
+        def copy_file(self, src, dest):
+            self._call('CopyObject', self.fs.copy_file, src, dest)
+
+        def open_input_stream(self, path):
+            return self._call('GetObject', self.fs.open_input_stream, path)
+
+        def open_input_file(self, path):
+            return self._call('GetObject', self.fs.open_input_file, path)
+
+        def open_output_stream(self, path, metadata):
+            stream = self.fs.open_output_stream(path, metadata=metadata)
+            return PythonFile(_MeteredOutputStream(stream, self.metrics), mode='w')
+
+        def open_append_stream(self, path, metadata):
+            stream = self.fs.open_append_stream(path, metadata=metadata)
+            return PythonFile(_MeteredOutputStream(stream, self.metrics), mode='w')
+
+    _MeteredHandler = MeteredHandler
+    return _MeteredHandler
+
+
+class _MeteredOutputStream:
+    """
+    Output stream of a metered filesystem: counts the bytes written and records the object upload when closed.
+    """
+
+    def __init__(self, stream, metrics):
+        self.stream = stream
+        self.metrics = metrics
+        self.bytes_written = 0
+
+    @property
+    def closed(self):
+        return self.stream.closed
+
+    def write(self, data):
+        self.bytes_written += memoryview(data).nbytes
+        return self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush()
+
+    def tell(self):
+        return self.stream.tell()
+
+    def close(self):
+        if self.stream.closed:
+            return
+        started_at = time.perf_counter()
+        error = None
+        try:
+            self.stream.close()
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.metrics.record_s3_call('parquet.PutObject', time.perf_counter() - started_at, self.bytes_written,
+                                        error=error)
+
+
+def _body_size(body):
+    """
+    Returns the size of the Body of an S3 request: bytes, or a seekable file-like object
+    (botocore wraps bytes bodies in BytesIO before the request hooks run).
+    """
+    if body is None:
+        return 0
+    if isinstance(body, (bytes, bytearray, str)):
+        return len(body)
+    try:
+        position = body.tell()
+        size = body.seek(0, os.SEEK_END) - position
+        body.seek(position)
+        return size
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Metrics of the current run, shared by the API layer and the S3 uploads
+run_metrics = RunMetrics()
@@ -0,0 +1,54 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1000  # Number of records serialized before each write
+
+
+def iter_ndjson_chunks(records, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Serialize a stream of records to newline-delimited JSON, `chunk_size` records at a time.
+
+    Params:
+        records (iterable): The records to serialize, dictionaries or objects with a "to_dict" method.
+        chunk_size (int): The number of records per chunk.
+
+    Yields:
+        str: Chunks of NDJSON text, each line holding one record.
+    """
+    lines = []
+    for record in records:
+        if hasattr(record, 'to_dict'):
+            record = record.to_dict()
+        lines.append(json.dumps(record, ensure_ascii=False))
+        if len(lines) >= chunk_size:
+            lines.append('')
+            yield '\n'.join(lines)
+            lines = []
+
+    if lines:
+        lines.append('')
+        yield '\n'.join(lines)
+
+
+def write_ndjson(records, path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Stream records to a newline-delimited JSON file, without holding the whole dataset in memory.
+
+    Params:
+        records (iterable): The records to write, e.g. the output of "youtube_api_requests.iter_video_comments".
+        path (str): The path of the file to write.
+        chunk_size (int): The number of records serialized before each write.
+
+    Returns:
+        int: The number of records written.
+    """
+    count = 0
+    with open(path, 'w', encoding='utf-8') as ndjson_file:
+        for chunk in iter_ndjson_chunks(records, chunk_size):
+            ndjson_file.write(chunk)
+            count += chunk.count('\n')
+
+    logger.info(f"{count} records written to {path}")
+    return count
@@ -0,0 +1,209 @@
+import logging
+import os
+import uuid
+from datetime import datetime, timezone
+
+from records import CommentRecord, VideoRecord, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 50000  # Number of rows converted to Arrow at a time
+
+VIDEO_INT_FIELDS = ('viewcount', 'likecount', 'commentcount')
+
+# A batch of comments spans one partition per channel, video and date: the default limit of pyarrow (1024)
+# is reached by a single channel with more than a thousand videos
+MAX_PARTITIONS = 1 << 20
+# Files kept open by the writer, under the usual limit of 1024 file descriptors. Beyond it, the least
+# recently used file is closed and the partition gets a new file, which does not fail the export
+MAX_OPEN_FILES = 900
+
+
+def _pyarrow():
+    """
+    Import pyarrow on first use, it is only needed for the Parquet export.
+    """
+    import pyarrow
+    import pyarrow.dataset
+    return pyarrow
+
+
+def _to_int(value):
+    """
+    Convert a count returned by the API ('123', 123, missing or {}) to an int, None when it is unknown.
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def videos_schema():
+    pa = _pyarrow()
+    return pa.schema([
+        ('channel_name', pa.string()),
+        ('video_id', pa.string()),
+        ('title', pa.string()),
+        ('description', pa.string()),
+        ('viewcount', pa.int64()),
+        ('likecount', pa.int64()),
+        ('commentcount', pa.int64()),
+        ('snapshot_at', pa.timestamp('us', tz='UTC')),
+    ])
+
+
+def comments_schema():
+    pa = _pyarrow()
+    return pa.schema([
+        ('channel_name', pa.string()),
+        ('video_id', pa.string()),
+        ('date', pa.string()),
+        ('id', pa.string()),
+        ('text_original', pa.string()),
+        ('published_at', pa.timestamp('us', tz='UTC')),
+        ('like_count', pa.int64()),
+        ('kind', pa.string()),
+        ('parent_id', pa.string()),
+        ('snapshot_at', pa.timestamp('us', tz='UTC')),
+    ])
+
+
+def _video_row(video):
+    if isinstance(video, VideoRecord):
+        # Already typed, no conversion needed
+        return video.to_dict()
+    row = {name: video.get(name) for name in ('channel_name', 'video_id', 'title', 'description')}
+    for name in VIDEO_INT_FIELDS:
+        row[name] = _to_int(video.get(name))
+    return row
+
+
+def _comment_row(comment, channel_by_video):
+    if isinstance(comment, CommentRecord):
+        # Already typed, no conversion needed
+        published_at = comment.published_at
+        return {
+            'channel_name': channel_by_video.get(comment.video_id, ''),
+            'video_id': comment.video_id,
+            'date': published_at.date().isoformat() if published_at else 'unknown',
+            'id': comment.comment_id,
+            'text_original': comment.text_original,
+            'published_at': published_at,
+            'like_count': comment.like_count,
+            'kind': comment.kind,
+            'parent_id': comment.parent_id,
+        }
+
+    published_at = parse_timestamp(comment.get('published_at'))
+    parent_id = comment.get('parentId')
+    return {
+        'channel_name': channel_by_video.get(comment.get('video_id'), ''),
+        'video_id': comment.get('video_id'),
+        'date': published_at.date().isoformat() if published_at else 'unknown',
+        'id': comment.get('id') or None,
+        'text_original': comment.get('text_original') or None,
+        'published_at': published_at,
+        'like_count': _to_int(comment.get('like_count')),
+        'kind': comment.get('kind'),
+        'parent_id': parent_id if isinstance(parent_id, str) else None,
+    }
+
+
+def _record_batches(rows, schema, batch_size):
+    """
+    Group rows into Arrow record batches of at most `batch_size` rows, so that the whole dataset is never materialized.
+    """
+    pa = _pyarrow()
+    buffer = []
+    for row in rows:
+        buffer.append(row)
+        if len(buffer) >= batch_size:
+            yield pa.RecordBatch.from_pylist(buffer, schema=schema)
+            buffer = []
+    if buffer:
+        yield pa.RecordBatch.from_pylist(buffer, schema=schema)
+
+
+def s3_filesystem():
+    """
+    Create the pyarrow S3 filesystem, honouring S3_ENDPOINT_URL for S3-compatible stand-ins.
+    Datasets are then addressed as 'bucket/prefix'.
+    """
+    from pyarrow import fs
+    endpoint_url = os.getenv('S3_ENDPOINT_URL')
+    if endpoint_url:
+        scheme, _, endpoint = endpoint_url.partition('://')
+        return fs.S3FileSystem(endpoint_override=endpoint, scheme=scheme)
+    return fs.S3FileSystem()
+
+
+def _write_dataset(batches, schema, root, partition_cols, filesystem, append=False):
+    """
+    Write record batches to a hive-partitioned Parquet dataset, in new files named after a unique run ID.
+
+    A full export replaces the partitions it writes, so that running it again does not duplicate the rows.
+    With `append`, e.g. for the deltas of the incremental modes, the files of the previous runs are kept
+    and the partitions accumulate the rows of every run, told apart by their `snapshot_at`.
+    """
+    pa = _pyarrow()
+    pa.dataset.write_dataset(
+        batches,
+        root,
+        schema=schema,
+        format='parquet',
+        partitioning=partition_cols,
+        partitioning_flavor='hive',
+        basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+        existing_data_behavior='overwrite_or_ignore' if append else 'delete_matching',
+        max_partitions=MAX_PARTITIONS,
+        max_open_files=MAX_OPEN_FILES,
+        filesystem=filesystem,
+    )
+    logger.info(f"Parquet dataset written to {root}")
+
+
+def write_videos_parquet(videos_info, root, filesystem=None, batch_size=DEFAULT_BATCH_SIZE, append=False, snapshot_at=None):
+    """
+    Write video details to a Parquet dataset partitioned by channel, with typed numeric columns.
+
+    Params:
+        videos_info (iterable): The video details, see "youtube_api_requests.get_videos_info".
+        root (str): The root directory of the dataset, a local path or 'bucket/prefix' with an S3 filesystem.
+        filesystem: A pyarrow filesystem, e.g. "s3_filesystem()". The local filesystem by default.
+        batch_size (int): The number of rows converted to Arrow at a time.
+        append (bool): Keep the rows of the previous exports, e.g. when `videos_info` only holds the videos
+                       of an incremental run. By default, the channels written replace their previous rows.
+        snapshot_at (datetime): The time of the extraction, stored in the `snapshot_at` column. Now by default.
+    """
+    schema = videos_schema()
+    snapshot_at = snapshot_at or datetime.now(timezone.utc)
+    rows = (dict(_video_row(video), snapshot_at=snapshot_at) for video in videos_info)
+    _write_dataset(_record_batches(rows, schema, batch_size), schema, root, ['channel_name'], filesystem, append)
+
+
+def write_comments_parquet(comments, videos_info, root, filesystem=None, batch_size=DEFAULT_BATCH_SIZE,
+                           channel_by_video=None, append=False, snapshot_at=None):
+    """
+    Write comments to a Parquet dataset partitioned by channel, video and publication date.
+
+    Params:
+        comments (iterable): The comments, e.g. the output of "youtube_api_requests.iter_video_comments".
+        videos_info (list): The video details, used to look up the channel of each comment.
+        root (str): The root directory of the dataset, a local path or 'bucket/prefix' with an S3 filesystem.
+        filesystem: A pyarrow filesystem, e.g. "s3_filesystem()". The local filesystem by default.
+        batch_size (int): The number of rows converted to Arrow at a time.
+        channel_by_video (dict): The channel name of each video ID, added to the ones of `videos_info`. It is read
+                                 row by row, so it can be filled while the comments are produced, see "pipeline.py".
+        append (bool): Keep the rows of the previous exports, e.g. for the comments of the delta mode.
+                       By default, the video and date partitions written replace their previous rows.
+        snapshot_at (datetime): The time of the extraction, stored in the `snapshot_at` column. Now by default.
+    """
+    channel_by_video = channel_by_video if channel_by_video is not None else {}
+    for video in videos_info:
+        channel_by_video[video.get('video_id')] = video.get('channel_name', '')
+
+    schema = comments_schema()
+    snapshot_at = snapshot_at or datetime.now(timezone.utc)
+    rows = (dict(_comment_row(comment, channel_by_video), snapshot_at=snapshot_at) for comment in comments)
+    _write_dataset(_record_batches(rows, schema, batch_size), schema, root, ['channel_name', 'video_id', 'date'],
+                   filesystem, append)
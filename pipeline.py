@@ -0,0 +1,298 @@
+import logging
+import queue
+import threading
+import time
+
+import youtube_api_requests as ytapi
+from records import VideoRecord
+
+logger = logging.getLogger(__name__)
+
+COMMENTS_PER_ITEM = 100  # Comments handed over to the upload at a time, the size of a commentThreads.list page
+
+# End of a stream, sent downstream once every worker of a stage is done
+_DONE = object()
+
+
+class _Stopped(Exception):
+    """
+    Raised in the stage threads when the pipeline is stopped by an error in another stage.
+    """
+
+
+class _Stage:
+    """
+    Worker threads applying `func` to the items of `inbox` and putting the items it yields into `outbox`.
+
+    Each thread owns its API client. When the last worker of the stage is done, the end of the stream is
+    passed on to the next stage. Any error stops the whole pipeline.
+    """
+
+    def __init__(self, pipeline, name, func, inbox, outbox, workers):
+        self.pipeline = pipeline
+        self.name = name
+        self.func = func
+        self.inbox = inbox
+        self.outbox = outbox
+        self.lock = threading.Lock()
+        self.running = workers
+        self.threads = [threading.Thread(target=self._work, name=f"pipeline-{name}-{index}", daemon=True)
+                        for index in range(workers)]
+        # Time waiting for input (the stage is starved) and for room in the next queue (backpressure)
+        self.stats = {'items_in': 0, 'items_out': 0, 'busy_s': 0.0, 'starved_s': 0.0, 'blocked_s': 0.0}
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+    def _count(self, name, value):
+        with self.lock:
+            self.stats[name] += value
+
+    def _work(self):
+        ytapi.init_worker()
+        try:
+            while True:
+                started_at = time.perf_counter()
+                item = self.pipeline._get(self.inbox)
+                self._count('starved_s', time.perf_counter() - started_at)
+                if item is _DONE:
+                    # Let the other workers of the stage see the end of the stream too
+                    self.pipeline._put(self.inbox, _DONE)
+                    break
+
+                self._count('items_in', 1)
+                started_at = time.perf_counter()
+                blocked = 0.0
+                for output in self.func(item):
+                    put_at = time.perf_counter()
+                    self.pipeline._put(self.outbox, output)
+                    blocked += time.perf_counter() - put_at
+                    self._count('items_out', 1)
+                self._count('blocked_s', blocked)
+                self._count('busy_s', time.perf_counter() - started_at - blocked)
+
+            with self.lock:
+                self.running -= 1
+                last = self.running == 0
+            if last:
+                self.pipeline._put(self.outbox, _DONE)
+
+        except _Stopped:
+            pass
+
+        except BaseException as e:
+            self.pipeline._fail(self.name, e)
+
+
+class Pipeline:
+    """
+    Pipelined extraction: channel resolution, playlist paging, video details, comments and the upload run
+    concurrently, as stages linked by bounded queues.
+
+    The comments of the first videos are fetched and uploaded while the playlists of the other channels are
+    still being paged, so the run takes about as long as its slowest stage instead of the sum of the stages.
+    A full queue blocks the stage feeding it, so a slow upload throttles the API calls instead of letting
+    the comments pile up in memory.
+
+    The comments reach the upload as the videos complete, not in the order of the channels and videos.
+    The channels and videos fetched are kept in `channels` and `videos`, and the channel of each video
+    in `channel_by_video`, as they arrive. `stats` reports the work and waits of each stage.
+    """
+
+    def __init__(self, channel_ids, max_workers=1, queue_size=None, cache=None, state=None, comments_state=None,
+                 recent_count=ytapi.DEFAULT_RECENT_VIDEOS, batch_size=None, as_records=False):
+        """
+        Params:
+            channel_ids (list): The IDs of the channels to extract.
+            max_workers (int): The number of worker threads of the playlist, video and comment stages each.
+                               The replies missing from the comment threads are fetched by a pool of the same size.
+            queue_size (int): The number of items each queue holds before blocking its producers,
+                              2 * `max_workers` by default.
+            cache (channel_cache.ChannelCache): Optional cache of the channels, see "get_channel_info".
+            state (sync_state.SyncState): Optional state enabling the incremental extraction of the videos,
+                                          see "get_videos_info". It is updated but not saved: save it
+                                          once the videos are stored.
+            comments_state (sync_state.SyncState): Optional state enabling the comment delta mode, see
+                                                   "get_video_comments". It is updated as the videos complete
+                                                   but not saved: save it once the comments are stored.
+            recent_count (int): In incremental mode, the number of latest videos per channel whose details are refreshed.
+            batch_size (int): Coalesce the first-page comment requests of up to `batch_size` videos in one batch
+                              HTTP exchange, see "get_video_comments". None to send one request per page.
+            as_records (bool): Produce records objects instead of dictionaries.
+        """
+        self.channel_ids = list(dict.fromkeys(channel_ids))
+        self.max_workers = max(max_workers or 1, 1)
+        self.queue_size = queue_size or 2 * self.max_workers
+        self.cache = cache
+        self.state = state
+        self.comments_state = comments_state
+        self.recent_count = recent_count
+        self.batch_size = batch_size
+        self.as_records = as_records
+
+        self.channels = []
+        self.videos = []
+        self.channel_by_video = {}
+        self.stats = {}
+
+        self.stop = threading.Event()
+        self.error = None
+        self.reply_executor = None
+
+    def _fail(self, stage_name, error):
+        if not self.stop.is_set():
+            logger.error(f"Pipeline stage {stage_name} failed: {error!r}")
+            self.error = error
+            self.stop.set()
+
+    def _put(self, items, item):
+        while not self.stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise _Stopped()
+
+    def _get(self, items):
+        while not self.stop.is_set():
+            try:
+                return items.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        raise _Stopped()
+
+    def _resolve_channels(self, channel_ids):
+        """
+        Channel stage: resolves up to MAX_IDS_PER_REQUEST channels per call.
+        """
+        for channel_info in ytapi.get_channel_info(channel_ids, cache=self.cache, as_records=self.as_records):
+            self.channels.append(channel_info)
+            yield channel_info
+
+    def _page_playlist(self, channel_info):
+        """
+        Playlist stage: yields the video batches of a channel page by page, then the latest known videos in
+        incremental mode, updating the state once the playlist was fully paged.
+        """
+        channel_name = channel_info.get('channel_name', '')
+        playlist_task = ytapi.channel_playlist_task(channel_info, self.state)
+        # Read before the paging updates the state, which adds the new videos to the latest known ones
+        known_ids = self.state.get_recent_video_ids(playlist_task[0])[:self.recent_count] if self.state is not None else []
+        new_videos = []
+
+        def on_complete():
+            if self.state is not None:
+                self.state.update_channel(playlist_task[0], new_videos, self.recent_count)
+
+        for page in ytapi.iter_playlist_pages(playlist_task, on_complete):
+            new_videos.extend(page)
+            yield from ytapi.video_batches([video.get('videoId', '') for video in page], channel_name)
+
+        if self.state is not None:
+            # Refresh the statistics of the latest known videos along with the new ones
+            seen = {video.get('videoId') for video in new_videos}
+            recent_ids = [video_id for video_id in known_ids if video_id not in seen]
+            yield from ytapi.video_batches(recent_ids, channel_name)
+            logger.info(f"{len(new_videos)} new videos for channel {channel_name}")
+
+    def _fetch_videos(self, batch_task):
+        """
+        Video stage: fetches the details of a batch of videos, handed over one by one, or in groups of
+        `batch_size` videos when the first comment pages are batched.
+        """
+        videos = ytapi.get_videos_batch(batch_task)
+        for video_info in videos:
+            self.channel_by_video[video_info['video_id']] = video_info['channel_name']
+            self.videos.append(VideoRecord.from_dict(video_info) if self.as_records else video_info)
+        yield from ytapi.chunks(videos, self.batch_size or 1)
+
+    def _fetch_comments(self, videos):
+        """
+        Comment stage: fetches the comments of a group of videos, handed over COMMENTS_PER_ITEM at a time.
+        """
+        if self.batch_size:
+            comments = ytapi.get_comments_of_videos_batch(videos, self.as_records, self.reply_executor,
+                                                          self.comments_state)
+            yield from ytapi.chunks(comments, COMMENTS_PER_ITEM)
+            return
+
+        for video in videos:
+            skip, since, on_complete = ytapi.delta_sync(video, self.comments_state)
+            if skip:
+                continue
+            comments = ytapi.iter_comments_of_video(video.get('video_id', ''), video.get('channel_name'),
+                                                    self.as_records, self.reply_executor, since=since,
+                                                    on_complete=on_complete)
+            yield from ytapi.ichunks(comments, COMMENTS_PER_ITEM)
+
+    def _iter_comments(self, comments_queue):
+        """
+        Upload stage input: yields the comments until the end of the stream, or raises the error that stopped
+        the pipeline, so that the upload is aborted rather than completed with missing comments.
+        """
+        while True:
+            try:
+                comments = self._get(comments_queue)
+            except _Stopped:
+                raise self.error
+            if comments is _DONE:
+                return
+            yield from comments
+
+    def run(self, sink):
+        """
+        Runs the pipeline until every comment went through `sink`.
+
+        Params:
+            sink (callable): The upload stage, called in the current thread with an iterable of the comments,
+                             e.g. lambda comments: s3_upload.upload_records(comments, bucket, key).
+
+        Returns:
+            The return value of `sink`.
+        """
+        inputs = queue.Queue()
+        for channel_ids in ytapi.chunks(self.channel_ids, ytapi.MAX_IDS_PER_REQUEST):
+            inputs.put(channel_ids)
+        inputs.put(_DONE)
+        channels_queue = queue.Queue(self.queue_size)
+        batches_queue = queue.Queue(self.queue_size)
+        videos_queue = queue.Queue(self.queue_size)
+        comments_queue = queue.Queue(self.queue_size)
+
+        self.reply_executor = ytapi.create_executor(self.max_workers)
+        stages = [
+            _Stage(self, 'channels', self._resolve_channels, inputs, channels_queue, 1),
+            _Stage(self, 'playlists', self._page_playlist, channels_queue, batches_queue, self.max_workers),
+            _Stage(self, 'videos', self._fetch_videos, batches_queue, videos_queue, self.max_workers),
+            _Stage(self, 'comments', self._fetch_comments, videos_queue, comments_queue, self.max_workers),
+        ]
+
+        started_at = time.perf_counter()
+        try:
+            for stage in stages:
+                stage.start()
+            result = sink(self._iter_comments(comments_queue))
+        except BaseException as e:
+            self._fail('upload', e)
+            raise
+        finally:
+            # Unblocks the stages if the upload stopped early
+            self.stop.set()
+            for stage in stages:
+                stage.join()
+            if self.reply_executor is not None:
+                self.reply_executor.shutdown(cancel_futures=True)
+            self.stats = {stage.name: stage.stats for stage in stages}
+            for name, stats in self.stats.items():
+                logger.info(f"Pipeline stage {name}: {stats['items_in']} items in, {stats['items_out']} out, "
+                            f"busy {stats['busy_s']:.1f}s, starved {stats['starved_s']:.1f}s, "
+                            f"blocked {stats['blocked_s']:.1f}s (thread seconds)")
+            logger.info(f"Pipeline run in {time.perf_counter() - started_at:.1f}s")
+
+        return result
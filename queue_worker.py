@@ -0,0 +1,325 @@
+"""
+Distributed mode of the pipeline: worker processes draining the durable work queue of "work_queue.py".
+
+    python queue_worker.py seed UCtYLUTtgS3k1Fg4y5tAhLbw UCCezIgC97PvUuR4_gbFUs5g
+    python queue_worker.py work --processes 4 --output-dir output
+    python queue_worker.py status
+
+Each task fetches one API page (channels, playlist page, video batch or comment page), writes its records to
+a deterministic output object, and enqueues the tasks of the next pages. A crashed worker's tasks are leased
+again once their lease expires, and rewriting an output object is harmless, so the run resumes without
+repeating the completed tasks. Each worker process uses its own API key from API_KEYS_YOUTUBE_API.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import re
+import socket
+import time
+
+from dotenv import load_dotenv
+from googleapiclient.errors import HttpError
+
+import youtube_api_requests as ytapi
+from metrics import run_metrics
+from ndjson_writer import write_ndjson
+from s3_upload import create_s3_client, upload_records
+from quota_scheduler import QuotaExceeded, QUOTA_ERROR_REASONS, RATE_LIMIT_ERROR_REASONS, http_error_reason
+from work_queue import WorkQueue, DEFAULT_QUEUE_PATH, DEFAULT_LEASE_SECONDS, DEFAULT_MAX_ATTEMPTS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+load_dotenv()
+
+POLL_INTERVAL = 2  # Seconds between two lease attempts while the other workers hold the remaining tasks
+
+# Errors that retrying cannot fix, e.g. a video whose comments are disabled: the task completes without output
+PERMANENT_ERROR_STATUSES = (400, 403, 404)
+
+
+def api_key_pool():
+    """
+    Returns the API keys available to the workers: API_KEYS_YOUTUBE_API (comma-separated), or API_KEY_YOUTUBE_API.
+    """
+    keys = [key.strip() for key in os.getenv('API_KEYS_YOUTUBE_API', '').split(',') if key.strip()]
+    return keys or [os.getenv('API_KEY_YOUTUBE_API')]
+
+
+def _safe_name(value):
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', value or 'unknown')
+
+
+def channel_task(channel_ids):
+    return 'channel', f"channel:{','.join(channel_ids)}", {'channel_ids': list(channel_ids)}
+
+
+def playlist_page_task(uploads_playlist_id, channel_name, page_token=None, page=0):
+    payload = {'uploads_playlist_id': uploads_playlist_id, 'channel_name': channel_name,
+               'page_token': page_token, 'page': page}
+    return 'playlist-page', f"playlist-page:{uploads_playlist_id}:{page}", payload
+
+
+def video_batch_task(video_ids, channel_name, uploads_playlist_id, page):
+    payload = {'video_ids': video_ids, 'channel_name': channel_name, 'uploads_playlist_id': uploads_playlist_id,
+               'page': page}
+    return 'video-batch', f"video-batch:{uploads_playlist_id}:{page}", payload
+
+
+def comment_page_task(video_id, channel_name, page_token=None, page=0):
+    payload = {'video_id': video_id, 'channel_name': channel_name, 'page_token': page_token, 'page': page}
+    return 'comment-page', f"comment-page:{video_id}:{page}", payload
+
+
+def seed_channels(queue, channel_ids):
+    """
+    Enqueue the channel tasks of a run, MAX_IDS_PER_REQUEST channels per task.
+    Channels already in the queue, from a previous or interrupted run, are not enqueued again.
+    """
+    channel_ids = list(dict.fromkeys(channel_ids))
+    tasks = [channel_task(batch) for batch in ytapi.chunks(channel_ids, ytapi.MAX_IDS_PER_REQUEST)]
+    queue.enqueue(tasks)
+    logger.info(f"Seeded {len(channel_ids)} channels in {len(tasks)} tasks")
+
+
+def _handle_channel(payload):
+    response = ytapi.fetch_channels(payload['channel_ids'])
+    channels = [ytapi.build_channel_info(item) for item in response.get('items', [])]
+    follow_ups = [playlist_page_task(channel['uploads_playlist_id'], channel['channel_name']) for channel in channels]
+    return [(f"channels/{_safe_name(payload['channel_ids'][0])}", channels)], follow_ups
+
+
+def _handle_playlist_page(payload):
+    uploads_playlist_id, channel_name, page = payload['uploads_playlist_id'], payload['channel_name'], payload['page']
+    with run_metrics.scope(channel_name):
+        response = ytapi.fetch_playlist_page(uploads_playlist_id, payload['page_token'])
+
+    video_ids = [item['contentDetails']['videoId'] for item in response.get('items', [])]
+    follow_ups = []
+    if video_ids:
+        # A playlist page holds at most 50 videos, exactly what one videos.list call accepts
+        follow_ups.append(video_batch_task(video_ids, channel_name, uploads_playlist_id, page))
+    if response.get('nextPageToken'):
+        follow_ups.append(playlist_page_task(uploads_playlist_id, channel_name, response['nextPageToken'], page + 1))
+    return [], follow_ups
+
+
+def _handle_video_batch(payload):
+    channel_name = payload['channel_name']
+    with run_metrics.scope(channel_name):
+        response = ytapi.fetch_videos(payload['video_ids'])
+    videos = ytapi.build_videos_batch(payload['video_ids'], response, channel_name)
+
+    # Videos without comments, or with comments disabled, would spend a request for nothing
+    follow_ups = [comment_page_task(video['video_id'], channel_name) for video in videos
+                  if video.get('commentcount', '0') not in ('0', 0)]
+    name = f"videos/{_safe_name(channel_name)}/{_safe_name(payload['uploads_playlist_id'])}-{payload['page']:05d}"
+    return [(name, videos)], follow_ups
+
+
+def _fetch_all_replies(thread_id, channel_name):
+    """
+    Fetches all the replies of a comment thread. Unlike "youtube_api_requests._get_replies_of_thread", errors are
+    raised so that the task is retried instead of keeping the inline replies only.
+    """
+    replies = []
+    page_token = None
+    while True:
+        with run_metrics.scope(channel_name):
+            response = ytapi.fetch_replies_page(thread_id, page_token)
+        replies.extend(response.get('items', []))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return replies
+
+
+def _handle_comment_page(payload):
+    video_id, channel_name, page = payload['video_id'], payload['channel_name'], payload['page']
+    with run_metrics.scope(channel_name):
+        response = ytapi.fetch_comment_threads_page(video_id, payload['page_token'])
+
+    items = response.get('items', [])
+    harvested_replies = {}
+    for thread_id in ytapi.threads_missing_replies(items):
+        try:
+            harvested_replies[thread_id] = _fetch_all_replies(thread_id, channel_name)
+        except HttpError as e:
+            if not _is_permanent(e):
+                raise
+            # e.g. a thread deleted since the page was fetched: keep its inline replies
+            ytapi.log_http_error(e, f"replies of comment {thread_id}")
+    comments = list({comment.get('id') or id(comment): comment
+                     for comment in ytapi.build_comments(items, video_id, harvested_replies)}.values())
+
+    follow_ups = []
+    if response.get('nextPageToken'):
+        follow_ups.append(comment_page_task(video_id, channel_name, response['nextPageToken'], page + 1))
+    return [(f"comments/{_safe_name(channel_name)}/{_safe_name(video_id)}/page-{page:05d}", comments)], follow_ups
+
+
+TASK_HANDLERS = {
+    'channel': _handle_channel,
+    'playlist-page': _handle_playlist_page,
+    'video-batch': _handle_video_batch,
+    'comment-page': _handle_comment_page,
+}
+
+
+class LocalStore:
+    """
+    Writes the records of each task to `root`/<name>.ndjson. Files are replaced atomically, so a task run twice
+    leaves a single complete file.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def write(self, name, records):
+        path = os.path.join(self.root, f"{name}.ndjson")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        write_ndjson(records, tmp_path)
+        os.replace(tmp_path, path)
+
+
+class S3Store:
+    """
+    Uploads the records of each task to s3://`bucket`/`prefix`/<name>.ndjson(.gz). S3 objects appear
+    atomically, so a task run twice leaves a single complete object.
+    """
+
+    def __init__(self, bucket, prefix='queue', compression='gzip'):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.compression = compression
+        self.s3 = run_metrics.instrument_s3_client(create_s3_client())
+
+    def write(self, name, records):
+        upload_records(records, self.bucket, f"{self.prefix}/{name}.ndjson", s3=self.s3, compression=self.compression)
+
+
+def _is_permanent(e):
+    reason = http_error_reason(e)
+    return (e.resp.status in PERMANENT_ERROR_STATUSES
+            and reason not in QUOTA_ERROR_REASONS and reason not in RATE_LIMIT_ERROR_REASONS)
+
+
+def run_worker(queue, store, worker_id, api_key=None):
+    """
+    Lease and run tasks until the queue is drained, or until the daily quota of the worker's API key is spent.
+
+    Params:
+        queue (WorkQueue): The work queue.
+        store (LocalStore or S3Store): Where the records of the tasks are written.
+        worker_id (str): The identifier of the worker, recorded in the leases.
+        api_key (str): The API key of the worker, the default key otherwise.
+
+    Returns:
+        int: The number of tasks completed by the worker.
+    """
+    if api_key:
+        ytapi.set_api_key(api_key)
+    # A worker parked until the quota reset would hold its lease for hours: release the task and stop instead
+    ytapi.scheduler.wait_for_reset = False
+
+    completed = 0
+    while True:
+        task = queue.lease(worker_id)
+        if task is None:
+            if queue.is_drained():
+                break
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        try:
+            outputs, follow_ups = TASK_HANDLERS[task.kind](task.payload)
+            for name, records in outputs:
+                store.write(name, records)
+
+        except QuotaExceeded as e:
+            # Only this worker's key is spent: the workers using other keys take the task over
+            logger.warning(f"Worker {worker_id} stops: {e}")
+            queue.release(task, worker_id, str(e))
+            break
+
+        except HttpError as e:
+            if _is_permanent(e):
+                ytapi.log_http_error(e, task.key)
+                queue.complete(task)
+            else:
+                queue.fail(task, worker_id, ytapi.error_class(e))
+            continue
+
+        except Exception as e:
+            logger.error(f"Task {task.key} failed: {e}")
+            queue.fail(task, worker_id, f"{type(e).__name__}: {e}")
+            continue
+
+        if queue.complete(task, follow_ups):
+            completed += 1
+
+    logger.info(f"Worker {worker_id} completed {completed} tasks")
+    return completed
+
+
+def _worker_process(args, index):
+    """
+    Entry point of a worker process, using the key `index` of the key pool.
+    """
+    keys = api_key_pool()
+    api_key = keys[(args.key_offset + index) % len(keys)]
+    queue = WorkQueue(args.queue, lease_seconds=args.lease_seconds, max_attempts=args.max_attempts)
+    store = S3Store(args.bucket, args.prefix) if args.bucket else LocalStore(args.output_dir)
+    try:
+        run_worker(queue, store, f"{socket.gethostname()}-{os.getpid()}", api_key)
+    finally:
+        queue.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--queue', default=os.getenv('WORK_QUEUE_PATH', DEFAULT_QUEUE_PATH), help='SQLite file of the queue')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    seed = subparsers.add_parser('seed', help='enqueue the channels to extract')
+    seed.add_argument('channel_ids', nargs='+')
+
+    work = subparsers.add_parser('work', help='run worker processes until the queue is drained')
+    work.add_argument('--processes', type=int, default=1)
+    work.add_argument('--key-offset', type=int, default=0,
+                      help='index of the first API key used on this node, to spread the key pool across nodes')
+    work.add_argument('--output-dir', default='output', help='local directory of the records')
+    work.add_argument('--bucket', help='S3 bucket of the records, instead of --output-dir')
+    work.add_argument('--prefix', default='queue', help='S3 key prefix of the records')
+    work.add_argument('--lease-seconds', type=float, default=DEFAULT_LEASE_SECONDS)
+    work.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS)
+
+    subparsers.add_parser('status', help='print the number of tasks per kind and status')
+    subparsers.add_parser('retry-failed', help='requeue the tasks that failed too many times')
+    args = parser.parse_args(argv)
+
+    if args.command == 'work':
+        if args.processes == 1:
+            _worker_process(args, 0)
+        else:
+            processes = [multiprocessing.Process(target=_worker_process, args=(args, index))
+                         for index in range(args.processes)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+
+    queue = WorkQueue(args.queue)
+    try:
+        if args.command == 'seed':
+            seed_channels(queue, args.channel_ids)
+        elif args.command == 'retry-failed':
+            logger.info(f"{queue.retry_failed()} failed tasks requeued")
+        print(json.dumps(queue.counts(), indent=4))
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
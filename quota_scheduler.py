@@ -0,0 +1,221 @@
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from googleapiclient.errors import HttpError
+
+logger = logging.getLogger(__name__)
+
+# Quota units charged by the YouTube Data API for each endpoint we call
+QUOTA_COSTS = {
+    'channels.list': 1,
+    'playlistItems.list': 1,
+    'videos.list': 1,
+    'commentThreads.list': 1,
+    'comments.list': 1,
+}
+DEFAULT_DAILY_BUDGET = 10000  # Default quota of a Google Cloud project
+DEFAULT_REQUESTS_PER_SECOND = 10
+
+# The daily quota is reset at midnight Pacific time
+QUOTA_TIMEZONE = ZoneInfo('America/Los_Angeles')
+
+QUOTA_ERROR_REASONS = {'quotaExceeded', 'dailyLimitExceeded'}
+RATE_LIMIT_ERROR_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
+
+class QuotaExceeded(Exception):
+    """
+    Raised when the daily quota is spent and the scheduler is not allowed to wait for the reset.
+    """
+
+    def __init__(self, reset_at):
+        super().__init__(f"YouTube API daily quota exceeded, it resets at {reset_at.isoformat()}")
+        self.reset_at = reset_at
+
+
+def next_quota_reset(now=None):
+    """
+    Returns the next midnight in Pacific time, when the daily quota of the YouTube Data API is reset.
+
+    Params:
+        now (datetime): An aware datetime, the current time by default.
+
+    Returns:
+        datetime: The reset time, in Pacific time.
+    """
+    now = (now or datetime.now(QUOTA_TIMEZONE)).astimezone(QUOTA_TIMEZONE)
+    tomorrow = now.date() + timedelta(days=1)
+    return datetime(tomorrow.year, tomorrow.month, tomorrow.day, tzinfo=QUOTA_TIMEZONE)
+
+
+def http_error_reason(e):
+    """
+    Returns the reason of the first error in the body of an HttpError ('quotaExceeded', 'commentsDisabled', ...), or None.
+    """
+    try:
+        error_details = json.loads(e.content.decode('utf-8'))
+        return error_details.get('error', {}).get('errors', [{}])[0].get('reason')
+    except (ValueError, AttributeError, IndexError):
+        return None
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: allows `rate` acquisitions per second on average, with bursts of up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        Params:
+            rate (float): The number of tokens added per second, e.g. below 1 to spread a daily budget over the day.
+            capacity (float): The maximum number of tokens, `rate` by default but at least 1 so that a token can be taken.
+        """
+        if rate <= 0:
+            raise ValueError(f"rate must be positive, got {rate}")
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a token, sleeping until one is available.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class QuotaScheduler:
+    """
+    Central gate for the YouTube API calls: rate-limits them with a token bucket and tracks
+    the quota units spent against a daily budget.
+
+    When the budget is spent, or the API answers with a quota error, the calls waiting on the scheduler
+    are parked until the Pacific-time reset and then resume with the same request, so no page is lost.
+    With `wait_for_reset=False`, QuotaExceeded is raised instead so that the caller can save its work.
+    """
+
+    def __init__(self, daily_budget=DEFAULT_DAILY_BUDGET, requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+                 wait_for_reset=True, max_retries=5):
+        """
+        Params:
+            daily_budget (int): The number of quota units that can be spent per day.
+            requests_per_second (float): The average request rate allowed by the token bucket.
+            wait_for_reset (bool): Whether to wait for the quota reset or raise QuotaExceeded when the quota is spent.
+            max_retries (int): The number of retries, with exponential backoff, of a request hitting a rate limit error.
+        """
+        self.daily_budget = daily_budget
+        self.wait_for_reset = wait_for_reset
+        self.max_retries = max_retries
+        self.bucket = TokenBucket(requests_per_second)
+        self.lock = threading.Lock()
+        self.units_spent = 0
+        self.reset_at = next_quota_reset()
+
+    @property
+    def remaining(self):
+        """
+        The number of quota units left for the current day.
+        """
+        with self.lock:
+            self._roll_over()
+            return self.daily_budget - self.units_spent
+
+    def _roll_over(self):
+        """
+        Starts a new quota day once the reset time has passed. Must be called with the lock held.
+        """
+        if datetime.now(QUOTA_TIMEZONE) >= self.reset_at:
+            self.units_spent = 0
+            self.reset_at = next_quota_reset()
+
+    def _wait_for_reset(self, reset_at):
+        """
+        Parks the calling thread until the quota reset, or raises QuotaExceeded if the scheduler must not wait.
+        """
+        if not self.wait_for_reset:
+            raise QuotaExceeded(reset_at)
+        logger.error(f"Quota exceeded for the day. Pausing requests until the quota resets at {reset_at.isoformat()}.")
+        while datetime.now(QUOTA_TIMEZONE) < reset_at:
+            time.sleep(min(300, (reset_at - datetime.now(QUOTA_TIMEZONE)).total_seconds() + 1))
+
+    def acquire(self, endpoint, calls=1):
+        """
+        Reserves the quota units of `calls` requests to `endpoint` and waits for their rate-limit tokens.
+
+        Params:
+            endpoint (str): The endpoint name, e.g. 'videos.list', see QUOTA_COSTS.
+            calls (int): The number of requests about to be sent.
+        """
+        units = QUOTA_COSTS.get(endpoint, 1) * calls
+        while True:
+            with self.lock:
+                self._roll_over()
+                if self.units_spent + units <= self.daily_budget:
+                    self.units_spent += units
+                    break
+                reset_at = self.reset_at
+            self._wait_for_reset(reset_at)
+
+        for _ in range(calls):
+            self.bucket.acquire()
+
+    def quota_exhausted(self):
+        """
+        Marks the quota of the current day as spent, after the API answered with a quota error.
+        """
+        with self.lock:
+            self._roll_over()
+            self.units_spent = self.daily_budget
+
+    def execute(self, endpoint, request, on_retry=None, on_attempt=None):
+        """
+        Executes an API request once its quota units and rate-limit token are available.
+
+        Quota errors park the request until the reset and rate limit errors are retried with a backoff,
+        any other HttpError is raised to the caller.
+
+        Params:
+            endpoint (str): The endpoint name, e.g. 'videos.list', see QUOTA_COSTS.
+            request (HttpRequest): The request built by the API client.
+            on_retry (callable): Optional, called with the error reason before each new attempt of the request.
+            on_attempt (callable): Optional, called with the duration in seconds of each attempt of the request,
+                                   without the quota, rate-limit and backoff waits.
+
+        Returns:
+            dict: The response of the request.
+        """
+        retries = 0
+        while True:
+            self.acquire(endpoint)
+            started_at = time.perf_counter()
+            try:
+                try:
+                    return request.execute()
+                finally:
+                    if on_attempt is not None:
+                        on_attempt(time.perf_counter() - started_at)
+            except HttpError as e:
+                reason = http_error_reason(e)
+                if e.resp.status == 403 and reason in QUOTA_ERROR_REASONS:
+                    self.quota_exhausted()
+                elif e.resp.status in (403, 429) and reason in RATE_LIMIT_ERROR_REASONS and retries < self.max_retries:
+                    retries += 1
+                    time.sleep(2 ** retries)
+                else:
+                    raise
+                if on_retry is not None:
+                    on_retry(reason)
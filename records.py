@@ -0,0 +1,183 @@
+import sys
+from datetime import datetime, timezone
+
+# Top-level comments and replies, shared by every comment record
+KIND_TOP_LEVEL = sys.intern('top level')
+KIND_REPLY = sys.intern('reply')
+
+
+def _to_int(value, default=0):
+    """
+    Convert a count returned by the API ('123', 123, missing or {}) to an int.
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _to_str(value):
+    """
+    Returns `value` if it is a non-empty string, None otherwise (the API layer used {} as a default in places).
+    """
+    return value if isinstance(value, str) and value else None
+
+
+def parse_timestamp(value):
+    """
+    Convert an ISO 8601 timestamp returned by the API ('2024-01-31T12:00:00Z') to an aware datetime, None if it is unknown.
+    """
+    if isinstance(value, datetime):
+        return value
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+
+
+def format_timestamp(value):
+    """
+    Convert an aware datetime back to the ISO 8601 format of the API, None stays None.
+    """
+    if value is None:
+        return None
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class ChannelRecord:
+    """
+    Compact, typed channel information. See "youtube_api_requests.get_channel_info" for the fields.
+    """
+    __slots__ = ('channel_id', 'channel_name', 'description', 'viewcount', 'subscribers', 'videocount',
+                 'uploads_playlist_id')
+
+    def __init__(self, channel_id, channel_name, description, viewcount, subscribers, videocount, uploads_playlist_id):
+        self.channel_id = channel_id
+        self.channel_name = channel_name
+        self.description = description
+        self.viewcount = viewcount
+        self.subscribers = subscribers
+        self.videocount = videocount
+        self.uploads_playlist_id = uploads_playlist_id
+
+    @classmethod
+    def from_dict(cls, channel_info):
+        """
+        Build the record from a channel dictionary returned by "get_channel_info".
+        """
+        return cls(
+            _intern(channel_info.get('channel_id', '')),
+            _intern(channel_info.get('channel_name', '')),
+            channel_info.get('description', ''),
+            _to_int(channel_info.get('viewcount')),
+            _to_int(channel_info.get('subscribers')),
+            _to_int(channel_info.get('videocount')),
+            channel_info.get('uploads_playlist_id', ''),
+        )
+
+    def get(self, name, default=None):
+        # Lets the records stand in for the channel dictionaries in the API layer
+        return getattr(self, name, default)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class VideoRecord:
+    """
+    Compact, typed video details. See "youtube_api_requests.get_videos_info" for the fields.
+    """
+    __slots__ = ('channel_name', 'video_id', 'title', 'description', 'viewcount', 'likecount', 'commentcount')
+
+    def __init__(self, channel_name, video_id, title, description, viewcount, likecount, commentcount):
+        self.channel_name = channel_name
+        self.video_id = video_id
+        self.title = title
+        self.description = description
+        self.viewcount = viewcount
+        self.likecount = likecount
+        self.commentcount = commentcount
+
+    @classmethod
+    def from_dict(cls, video_info):
+        """
+        Build the record from a video dictionary returned by "get_videos_info". The IDs and channel names are interned.
+        """
+        return cls(
+            _intern(video_info.get('channel_name', '')),
+            _intern(video_info.get('video_id', '')),
+            video_info.get('title', ''),
+            video_info.get('description', ''),
+            _to_int(video_info.get('viewcount')),
+            _to_int(video_info.get('likecount')),
+            _to_int(video_info.get('commentcount')),
+        )
+
+    def get(self, name, default=None):
+        # Lets the records stand in for the video dictionaries in the API layer
+        return getattr(self, name, default)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class CommentRecord:
+    """
+    Compact, typed comment. See "youtube_api_requests.get_video_comments" for the fields.
+
+    The video IDs and kinds are interned, so the millions of comments of a channel share a few string objects,
+    and `published_at` is an aware datetime.
+    """
+    __slots__ = ('video_id', 'comment_id', 'text_original', 'published_at', 'like_count', 'kind', 'parent_id')
+
+    def __init__(self, video_id, comment_id, text_original, published_at, like_count, kind, parent_id=None):
+        self.video_id = video_id
+        self.comment_id = comment_id
+        self.text_original = text_original
+        self.published_at = published_at
+        self.like_count = like_count
+        self.kind = kind
+        self.parent_id = parent_id
+
+    @classmethod
+    def from_dict(cls, comment):
+        """
+        Build the record from a comment dictionary returned by "get_video_comments".
+        """
+        kind = KIND_REPLY if comment.get('kind') == KIND_REPLY else KIND_TOP_LEVEL
+        return cls(
+            _intern(comment.get('video_id', '')),
+            _to_str(comment.get('id')),
+            _to_str(comment.get('text_original')) or '',
+            parse_timestamp(comment.get('published_at')),
+            _to_int(comment.get('like_count')),
+            kind,
+            _to_str(comment.get('parentId')),
+        )
+
+    def get(self, name, default=None):
+        # Lets the records stand in for the comment dictionaries, with the names of the dictionary keys
+        return self.to_dict().get(name, default)
+
+    def to_dict(self):
+        """
+        Returns the comment in the dictionary layout of "get_video_comments", with typed values.
+        """
+        comment = {
+            'video_id': self.video_id,
+            'text_original': self.text_original,
+            'published_at': format_timestamp(self.published_at),
+            'like_count': self.like_count,
+            'kind': self.kind,
+        }
+        if self.comment_id is not None:
+            comment['id'] = self.comment_id
+        if self.parent_id is not None:
+            comment['parentId'] = self.parent_id
+        return comment
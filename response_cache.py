@@ -0,0 +1,151 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import parse_qsl, urlsplit
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = 'response_cache.sqlite'
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# Number of seconds a response stays valid, per endpoint
+DEFAULT_TTLS = {
+    'channels.list': 24 * 3600,
+    'playlistItems.list': 3600,
+    'videos.list': 6 * 3600,
+    'commentThreads.list': 6 * 3600,
+    'comments.list': 6 * 3600,
+}
+DEFAULT_TTL = 3600
+
+# Query parameters that do not change the response
+IGNORED_PARAMS = {'key', 'alt', 'prettyPrint', 'quotaUser'}
+
+
+class CacheMiss(Exception):
+    """
+    Raised in offline mode when a request is not in the cache.
+    """
+
+
+class ResponseCache:
+    """
+    Persistent on-disk cache of the YouTube API responses, stored in a SQLite file.
+
+    Responses are keyed by endpoint and normalized query parameters (including pageToken, excluding the API key),
+    expire after the TTL of their endpoint, and the least recently used ones are evicted once the cache grows
+    beyond `max_bytes`. In offline mode, the expired responses are replayed too and a missing one raises CacheMiss
+    instead of reaching the network.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttls=None, max_bytes=DEFAULT_MAX_BYTES, offline=False):
+        """
+        Params:
+            path (str): The path of the SQLite file, created if needed.
+            ttls (dict): The TTL in seconds of each endpoint, DEFAULT_TTLS by default.
+            max_bytes (int): The maximum total size of the stored (compressed) responses.
+            offline (bool): Whether to replay the cache only, without any network access.
+        """
+        self.path = path
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, endpoint TEXT NOT NULL, created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL, size INTEGER NOT NULL, body BLOB NOT NULL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+
+    @staticmethod
+    def request_key(endpoint, uri):
+        """
+        Returns the cache key of a request: a hash of the endpoint and of its sorted query parameters.
+
+        Params:
+            endpoint (str): The endpoint name, e.g. 'videos.list'.
+            uri (str): The URI of the request.
+        """
+        params = sorted((name, value) for name, value in parse_qsl(urlsplit(uri).query, keep_blank_values=True)
+                        if name not in IGNORED_PARAMS)
+        return hashlib.sha256(json.dumps([endpoint, params]).encode('utf-8')).hexdigest()
+
+    def get(self, endpoint, uri):
+        """
+        Returns the cached response of a request, or None if it is missing or expired.
+        In offline mode, a missing response raises CacheMiss.
+        """
+        key = self.request_key(endpoint, uri)
+        now = time.time()
+
+        with self.lock:
+            row = self.connection.execute("SELECT created_at, body FROM responses WHERE key = ?", (key,)).fetchone()
+            fresh = row is not None and (self.offline or now - row[0] <= self.ttls.get(endpoint, DEFAULT_TTL))
+            if fresh:
+                self.hits += 1
+                with self.connection:
+                    self.connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            else:
+                self.misses += 1
+
+        if fresh:
+            return json.loads(zlib.decompress(row[1]))
+        if self.offline:
+            raise CacheMiss(f"No cached response for {endpoint} {uri}")
+        return None
+
+    def put(self, endpoint, uri, response):
+        """
+        Stores the response of a request, then evicts the least recently used responses if the cache is too big.
+        """
+        key = self.request_key(endpoint, uri)
+        body = zlib.compress(json.dumps(response).encode('utf-8'))
+        now = time.time()
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, endpoint, created_at, accessed_at, size, body) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, endpoint, now, now, len(body), body)
+            )
+            self._evict()
+
+    def _evict(self):
+        """
+        Deletes the least recently used responses once the cache exceeds max_bytes, down to 90% of it
+        so that the next insertions do not trigger an eviction each. Must be called with the lock held.
+        """
+        total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+
+        evicted = 0
+        for key, size in self.connection.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall():
+            if total_size <= 0.9 * self.max_bytes:
+                break
+            self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total_size -= size
+            evicted += 1
+        logger.info(f"Evicted {evicted} responses from the response cache")
+
+    def purge_expired(self):
+        """
+        Deletes the expired responses of every endpoint.
+        """
+        now = time.time()
+        with self.lock, self.connection:
+            for endpoint, ttl in self.ttls.items():
+                self.connection.execute("DELETE FROM responses WHERE endpoint = ? AND created_at < ?", (endpoint, now - ttl))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
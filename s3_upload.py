@@ -0,0 +1,244 @@
+import logging
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+from ndjson_writer import iter_ndjson_chunks
+
+try:
+    import zstandard
+except ImportError:  # zstd compression is optional
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+MIN_PART_SIZE = 5 * 1024 * 1024  # S3 rejects multipart parts smaller than 5 MiB, except the last one
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+DEFAULT_MAX_WORKERS = 4
+
+# Content-Encoding and file extension of each supported compression
+COMPRESSIONS = {
+    None: (None, ''),
+    'gzip': ('gzip', '.gz'),
+    'zstd': ('zstd', '.zst'),
+}
+
+
+def create_s3_client():
+    """
+    Create an S3 client. The S3_ENDPOINT_URL environment variable points it to an S3-compatible
+    stand-in (MinIO, moto server, ...) instead of AWS.
+    """
+    return boto3.client('s3', endpoint_url=os.getenv('S3_ENDPOINT_URL') or None)
+
+
+def resolve_compression(compression):
+    """
+    Returns the compression to use: zstd falls back to gzip when the zstandard package is not installed.
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unsupported compression: {compression}")
+    if compression == 'zstd' and zstandard is None:
+        logger.warning("zstandard is not installed, falling back to gzip compression")
+        return 'gzip'
+    return compression
+
+
+def _create_compressor(compression):
+    """
+    Create a streaming compressor exposing "compress" and "flush", or None for no compression.
+    """
+    if compression == 'gzip':
+        return zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header and trailer
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    return None
+
+
+class S3StreamUploader:
+    """
+    Upload a stream of bytes to S3 as it is produced: the data is compressed on the fly and sent in
+    multipart parts of `part_size` bytes, uploaded in parallel by `max_workers` threads.
+
+    At most `max_workers` parts are buffered or in flight, so memory does not grow with the object size.
+    If anything fails, the multipart upload is aborted so that no orphan parts are billed. Use it as a
+    context manager, or call "close" (or "abort") explicitly.
+    """
+
+    def __init__(self, bucket, key, s3=None, compression='gzip', content_type='application/x-ndjson',
+                 part_size=DEFAULT_PART_SIZE, max_workers=DEFAULT_MAX_WORKERS):
+        """
+        Params:
+            bucket (str): The name of the S3 bucket.
+            key (str): The key of the object to write.
+            s3: A boto3 S3 client, created with "create_s3_client" by default.
+            compression (str): 'gzip', 'zstd' (gzip if zstandard is not installed) or None.
+            content_type (str): The ContentType of the object.
+            part_size (int): The size of the multipart parts, at least MIN_PART_SIZE.
+            max_workers (int): The number of parts uploaded in parallel.
+        """
+        if part_size < MIN_PART_SIZE:
+            raise ValueError(f"part_size must be at least {MIN_PART_SIZE} bytes")
+
+        self.bucket = bucket
+        self.key = key
+        self.s3 = s3 or create_s3_client()
+        self.compression = resolve_compression(compression)
+        self.content_encoding = COMPRESSIONS[self.compression][0]
+        self.content_type = content_type
+        self.part_size = part_size
+        self.max_workers = max_workers
+
+        self.compressor = _create_compressor(self.compression)
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.executor = None
+        self.futures = []
+        self.parts = []
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def _object_args(self):
+        """
+        The ContentType and ContentEncoding arguments of the object.
+        """
+        args = {'ContentType': self.content_type}
+        if self.content_encoding:
+            args['ContentEncoding'] = self.content_encoding
+        return args
+
+    def _upload_part(self, part_number, body):
+        """
+        Upload one part of the multipart upload. Runs on the worker threads, boto3 clients are thread-safe.
+        """
+        response = self.s3.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                       PartNumber=part_number, Body=body)
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+    def _collect(self, limit):
+        """
+        Wait for the oldest parts in flight until at most `limit` remain.
+        """
+        while len(self.futures) > limit:
+            self.parts.append(self.futures.pop(0).result())
+
+    def _send_part(self):
+        """
+        Send the first `part_size` bytes of the buffer as a new part.
+        """
+        if self.upload_id is None:
+            response = self.s3.create_multipart_upload(Bucket=self.bucket, Key=self.key, **self._object_args())
+            self.upload_id = response['UploadId']
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='s3part')
+
+        body = bytes(self.buffer[:self.part_size])
+        del self.buffer[:self.part_size]
+        self.bytes_out += len(body)
+
+        part_number = len(self.parts) + len(self.futures) + 1
+        self.futures.append(self.executor.submit(self._upload_part, part_number, body))
+        # Backpressure: do not buffer more than max_workers parts
+        self._collect(self.max_workers - 1)
+
+    def write(self, data):
+        """
+        Compress and buffer data, sending full parts as they fill up.
+
+        Params:
+            data (bytes or str): The data to append to the object. Strings are encoded in UTF-8.
+        """
+        if self.closed:
+            raise ValueError("Write to a closed S3StreamUploader")
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        self.bytes_in += len(data)
+        self.buffer += self.compressor.compress(data) if self.compressor else data
+        while len(self.buffer) >= self.part_size:
+            self._send_part()
+
+    def close(self):
+        """
+        Flush the compressor and complete the upload. Objects smaller than a part are sent with a single put_object.
+        """
+        if self.closed:
+            return
+        try:
+            if self.compressor:
+                self.buffer += self.compressor.flush()
+
+            if self.upload_id is None:
+                self.bytes_out += len(self.buffer)
+                self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer), **self._object_args())
+            else:
+                while self.buffer:
+                    self._send_part()
+                self._collect(0)
+                self.s3.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                                  MultipartUpload={'Parts': self.parts})
+        except Exception:
+            self.abort()
+            raise
+
+        self.closed = True
+        self._shutdown()
+        ratio = self.bytes_in / self.bytes_out if self.bytes_out else 0
+        logger.info(f"Uploaded s3://{self.bucket}/{self.key}: {self.bytes_in} bytes, {self.bytes_out} bytes sent (x{ratio:.1f})")
+
+    def abort(self):
+        """
+        Abort the multipart upload and discard its uploaded parts.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self._shutdown()
+        if self.upload_id is not None:
+            try:
+                self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+                logger.error(f"Upload of s3://{self.bucket}/{self.key} aborted")
+            except Exception as e:
+                logger.error(f"Failed to abort the upload of s3://{self.bucket}/{self.key}: {e}")
+
+    def _shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+
+def upload_records(records, bucket, key, s3=None, compression='gzip', **kwargs):
+    """
+    Stream records to S3 as compressed newline-delimited JSON, while they are being produced.
+
+    Params:
+        records (iterable): The records to upload, e.g. the output of "youtube_api_requests.iter_video_comments".
+        bucket (str): The name of the S3 bucket.
+        key (str): The key of the object, without the compression extension which is appended.
+        s3: A boto3 S3 client, created with "create_s3_client" by default.
+        compression (str): 'gzip', 'zstd' or None.
+        **kwargs: Other arguments of S3StreamUploader (part_size, max_workers).
+
+    Returns:
+        str: The key of the uploaded object.
+    """
+    compression = resolve_compression(compression)
+    key = f"{key}{COMPRESSIONS[compression][1]}"
+
+    with S3StreamUploader(bucket, key, s3=s3, compression=compression, **kwargs) as uploader:
+        for chunk in iter_ndjson_chunks(records):
+            uploader.write(chunk)
+
+    return key
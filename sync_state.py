@@ -0,0 +1,109 @@
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATE_PATH = 'sync_state.json'
+
+
+class SyncState:
+    """
+    Local JSON file keeping what previous runs already ingested, for the incremental mode.
+
+    For each channel, keyed by its uploads playlist ID:
+        - 'watermark': the most recent videoPublishedAt seen in the uploads playlist.
+        - 'recent_video_ids': the IDs of the latest videos, newest first, whose statistics are still refreshed.
+
+    For each video whose comments were synced, keyed by its video ID:
+        - 'commentcount': the comment count of the video when its comments were last synced.
+        - 'last_comment_at': the publishedAt of the most recent top-level comment ingested.
+    """
+
+    def __init__(self, path=DEFAULT_STATE_PATH):
+        """
+        Params:
+            path (str): The path of the JSON file backing the state. It is created on the first save.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.state = {'channels': {}, 'videos': {}}
+
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as json_file:
+                    self.state.update(json.load(json_file))
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"Ignoring unreadable sync state {path}: {e}")
+
+    def get_watermark(self, uploads_playlist_id):
+        """
+        Returns the videoPublishedAt high-watermark of a channel, or None if the channel was never synced.
+        """
+        with self.lock:
+            return self.state['channels'].get(uploads_playlist_id, {}).get('watermark')
+
+    def get_recent_video_ids(self, uploads_playlist_id):
+        """
+        Returns the IDs of the latest videos of a channel known from the previous runs, newest first.
+        """
+        with self.lock:
+            return list(self.state['channels'].get(uploads_playlist_id, {}).get('recent_video_ids', []))
+
+    def update_channel(self, uploads_playlist_id, new_videos, recent_count):
+        """
+        Records the videos found since the last run of a channel.
+
+        Params:
+            uploads_playlist_id (str): The uploads playlist ID of the channel.
+            new_videos (list): The contentDetails of the new playlist items ('videoId', 'videoPublishedAt'), newest first.
+            recent_count (int): The number of latest video IDs to keep for the statistics refresh.
+        """
+        with self.lock:
+            channel_state = self.state['channels'].setdefault(uploads_playlist_id, {})
+
+            published_at = [video.get('videoPublishedAt') for video in new_videos if video.get('videoPublishedAt')]
+            if channel_state.get('watermark'):
+                published_at.append(channel_state['watermark'])
+            if published_at:
+                channel_state['watermark'] = max(published_at)
+
+            new_ids = [video.get('videoId') for video in new_videos if video.get('videoId')]
+            recent_ids = list(dict.fromkeys(new_ids + channel_state.get('recent_video_ids', [])))
+            channel_state['recent_video_ids'] = recent_ids[:recent_count]
+
+    def get_video_comments(self, video_id):
+        """
+        Returns the comment sync state of a video, {'commentcount': ..., 'last_comment_at': ...},
+        or None if its comments were never synced.
+        """
+        with self.lock:
+            video_state = self.state['videos'].get(video_id)
+            return dict(video_state) if video_state is not None else None
+
+    def update_video_comments(self, video_id, commentcount, last_comment_at):
+        """
+        Records that the comments of a video were synced.
+
+        Params:
+            video_id (str): The ID of the video.
+            commentcount (str or int): The comment count of the video, from "get_videos_info".
+            last_comment_at (str): The publishedAt of the most recent top-level comment ingested,
+                                   None to keep the previous one (no new comment).
+        """
+        with self.lock:
+            video_state = self.state['videos'].setdefault(video_id, {})
+            video_state['commentcount'] = str(commentcount)
+            if last_comment_at and last_comment_at > video_state.get('last_comment_at', ''):
+                video_state['last_comment_at'] = last_comment_at
+
+    def save(self):
+        """
+        Writes the state to disk. The file is replaced atomically so that a crash never leaves it truncated.
+        """
+        with self.lock:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as json_file:
+                json.dump(self.state, json_file)
+            os.replace(tmp_path, self.path)
@@ -0,0 +1,155 @@
+import copy
+import os
+
+os.environ.setdefault('API_KEY_YOUTUBE_API', 'test')
+
+import pytest
+
+import youtube_api_requests as ytapi
+from benchmarks.fake_youtube_api import parse_fields, select_fields
+
+# Full resources as returned by the API without a fields mask, including fields the records do not use
+CHANNEL = {
+    'kind': 'youtube#channel',
+    'etag': 'etag-channel',
+    'id': 'UCchannel',
+    'snippet': {
+        'title': 'Channel',
+        'description': 'About the channel',
+        'customUrl': '@channel',
+        'publishedAt': '2015-01-01T00:00:00Z',
+        'thumbnails': {'default': {'url': 'https://example.com/default.jpg', 'width': 88, 'height': 88}},
+        'localized': {'title': 'Channel', 'description': 'About the channel'},
+        'country': 'US',
+    },
+    'contentDetails': {'relatedPlaylists': {'likes': '', 'uploads': 'UUchannel'}},
+    'statistics': {'viewCount': '1000', 'subscriberCount': '100', 'hiddenSubscriberCount': False, 'videoCount': '10'},
+}
+
+PLAYLIST_PAGE = {
+    'kind': 'youtube#playlistItemListResponse',
+    'etag': 'etag-playlist',
+    'nextPageToken': 'page-2',
+    'pageInfo': {'totalResults': 2, 'resultsPerPage': 50},
+    'items': [{
+        'kind': 'youtube#playlistItem',
+        'etag': 'etag-item',
+        'id': 'item-1',
+        'contentDetails': {'videoId': 'video-1', 'videoPublishedAt': '2024-01-31T12:00:00Z'},
+    }],
+}
+
+VIDEO = {
+    'kind': 'youtube#video',
+    'etag': 'etag-video',
+    'id': 'video-1',
+    'snippet': {
+        'publishedAt': '2024-01-31T12:00:00Z',
+        'channelId': 'UCchannel',
+        'title': 'Video',
+        'description': 'About the video',
+        'thumbnails': {'default': {'url': 'https://example.com/video.jpg', 'width': 120, 'height': 90}},
+        'channelTitle': 'Channel',
+        'tags': ['data', 'python'],
+        'categoryId': '28',
+    },
+    'statistics': {'viewCount': '500', 'likeCount': '50', 'favoriteCount': '0', 'commentCount': '3'},
+}
+
+
+def _comment(comment_id, text, parent_id=None):
+    snippet = {
+        'channelId': 'UCchannel',
+        'videoId': 'video-1',
+        'textDisplay': f"<b>{text}</b>",
+        'textOriginal': text,
+        'authorDisplayName': '@author',
+        'authorProfileImageUrl': 'https://example.com/author.jpg',
+        'authorChannelId': {'value': 'UCauthor'},
+        'canRate': True,
+        'viewerRating': 'none',
+        'likeCount': 7,
+        'publishedAt': '2024-02-01T08:00:00Z',
+        'updatedAt': '2024-02-01T08:00:00Z',
+    }
+    if parent_id is not None:
+        snippet['parentId'] = parent_id
+    return {'kind': 'youtube#comment', 'etag': f"etag-{comment_id}", 'id': comment_id, 'snippet': snippet}
+
+
+COMMENT_THREADS_PAGE = {
+    'kind': 'youtube#commentThreadListResponse',
+    'etag': 'etag-threads',
+    'nextPageToken': 'threads-2',
+    'pageInfo': {'totalResults': 1, 'resultsPerPage': 100},
+    'items': [{
+        'kind': 'youtube#commentThread',
+        'etag': 'etag-thread',
+        'id': 'thread-1',
+        'snippet': {
+            'channelId': 'UCchannel',
+            'videoId': 'video-1',
+            'topLevelComment': _comment('thread-1', 'Top-level comment'),
+            'canReply': True,
+            'totalReplyCount': 2,
+            'isPublic': True,
+        },
+        'replies': {'comments': [_comment('thread-1.reply-1', 'First reply', parent_id='thread-1')]},
+    }],
+}
+
+COMMENTS_PAGE = {
+    'kind': 'youtube#commentListResponse',
+    'etag': 'etag-comments',
+    'nextPageToken': 'comments-2',
+    'items': [_comment('thread-1.reply-2', 'Second reply', parent_id='thread-1')],
+}
+
+
+def _masked(endpoint, response):
+    return select_fields(copy.deepcopy(response), parse_fields(ytapi.FIELD_MASKS[endpoint]))
+
+
+def test_channel_mask_keeps_the_channel_record():
+    masked = _masked('channels.list', {'items': [CHANNEL]})['items'][0]
+    assert 'etag' not in masked and 'thumbnails' not in masked['snippet']
+    assert ytapi.build_channel_info(masked) == ytapi.build_channel_info(CHANNEL)
+
+
+def test_playlist_mask_keeps_the_video_ids_and_paging():
+    masked = _masked('playlistItems.list', PLAYLIST_PAGE)
+    assert 'pageInfo' not in masked
+    assert masked['nextPageToken'] == PLAYLIST_PAGE['nextPageToken']
+    assert [item['contentDetails'] for item in masked['items']] == \
+        [item['contentDetails'] for item in PLAYLIST_PAGE['items']]
+
+
+def test_video_mask_keeps_the_video_record():
+    masked = _masked('videos.list', {'items': [VIDEO]})['items'][0]
+    assert 'tags' not in masked['snippet']
+    assert ytapi._build_video_info(masked, 'Channel') == ytapi._build_video_info(VIDEO, 'Channel')
+
+
+@pytest.mark.parametrize('harvested', [False, True])
+def test_comment_threads_mask_keeps_the_comment_records(harvested):
+    masked = _masked('commentThreads.list', COMMENT_THREADS_PAGE)
+    assert masked['nextPageToken'] == COMMENT_THREADS_PAGE['nextPageToken']
+    assert 'textDisplay' not in masked['items'][0]['snippet']['topLevelComment']['snippet']
+    # The thread still reports its missing replies
+    assert ytapi.threads_missing_replies(masked['items']) == ['thread-1']
+
+    full_replies = masked_replies = None
+    if harvested:
+        full_replies = {'thread-1': COMMENT_THREADS_PAGE['items'][0]['replies']['comments'] + COMMENTS_PAGE['items']}
+        masked_replies = {'thread-1': masked['items'][0]['replies']['comments'] +
+                                      _masked('comments.list', COMMENTS_PAGE)['items']}
+    assert ytapi.build_comments(masked['items'], 'video-1', masked_replies) == \
+        ytapi.build_comments(COMMENT_THREADS_PAGE['items'], 'video-1', full_replies)
+
+
+def test_comments_mask_keeps_the_reply_records():
+    masked = _masked('comments.list', COMMENTS_PAGE)
+    assert masked['nextPageToken'] == COMMENTS_PAGE['nextPageToken']
+    assert 'authorDisplayName' not in masked['items'][0]['snippet']
+    assert [ytapi._build_reply(reply, 'video-1') for reply in masked['items']] == \
+        [ytapi._build_reply(reply, 'video-1') for reply in COMMENTS_PAGE['items']]
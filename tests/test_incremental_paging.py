@@ -0,0 +1,25 @@
+import os
+
+os.environ.setdefault('API_KEY_YOUTUBE_API', 'test')
+
+import youtube_api_requests as ytapi
+
+
+def test_playlist_paging_skips_items_without_publication_date(monkeypatch):
+    pages = {
+        None: {'nextPageToken': 'page-2', 'items': [
+            {'contentDetails': {'videoId': 'new', 'videoPublishedAt': '2024-03-01T00:00:00Z'}},
+            # A private video, without videoPublishedAt
+            {'contentDetails': {'videoId': 'private'}},
+        ]},
+        'page-2': {'items': [
+            {'contentDetails': {'videoId': 'newer-page', 'videoPublishedAt': '2024-02-15T00:00:00Z'}},
+            {'contentDetails': {'videoId': 'old', 'videoPublishedAt': '2024-01-01T00:00:00Z'}},
+        ]},
+    }
+    monkeypatch.setattr(ytapi, 'fetch_playlist_page', lambda playlist_id, page_token=None: pages[page_token])
+
+    videos, complete = ytapi._get_playlist_videos(('UUchannel', '2024-02-01T00:00:00Z', None))
+
+    assert complete
+    assert [video['videoId'] for video in videos] == ['new', 'newer-page']
@@ -0,0 +1,30 @@
+import pyarrow.dataset as ds
+from pyarrow import fs
+
+from metrics import RunMetrics
+from parquet_export import write_videos_parquet
+
+
+def test_instrument_filesystem_records_the_parquet_writes(tmp_path):
+    metrics = RunMetrics()
+    filesystem = metrics.instrument_filesystem(fs.LocalFileSystem())
+    videos = [{'channel_name': f"channel{index}", 'video_id': f"video{index}", 'title': 'title', 'description': '',
+               'viewcount': '1', 'likecount': '1', 'commentcount': '1'} for index in range(3)]
+
+    write_videos_parquet(videos, str(tmp_path), filesystem=filesystem)
+
+    s3 = metrics.summary()['s3']
+    assert s3['parquet.PutObject']['calls'] == 3
+    written = sum(path.stat().st_size for path in tmp_path.rglob('*.parquet'))
+    assert s3['parquet.PutObject']['bytes_sent'] == written
+    assert ds.dataset(str(tmp_path), partitioning='hive').to_table().num_rows == 3
+
+
+def test_api_latency_excludes_the_waits():
+    metrics = RunMetrics()
+    metrics.record_api_call('videos.list', 0.2, 1000, quota_units=1, wait=30.0)
+
+    api = metrics.summary()['api']['videos.list']
+    assert api['latency_s']['max'] == 0.2
+    assert api['wait_s']['max'] == 30.0
+    assert api['response_bytes'] == 1000
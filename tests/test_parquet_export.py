@@ -0,0 +1,47 @@
+from datetime import datetime, timezone
+
+import pyarrow.dataset as ds
+
+from parquet_export import write_comments_parquet, write_videos_parquet
+
+
+def test_write_comments_parquet_beyond_default_max_partitions(tmp_path):
+    # One comment per video: a single record batch spans 3000 channel/video/date partitions
+    videos_info = [{'video_id': f"video{index}", 'channel_name': 'channel'} for index in range(3000)]
+    comments = [{
+        'video_id': f"video{index}",
+        'id': f"comment{index}",
+        'text_original': 'text',
+        'published_at': '2024-01-31T12:00:00Z',
+        'like_count': 1,
+        'kind': 'top level',
+    } for index in range(3000)]
+
+    write_comments_parquet(comments, videos_info, str(tmp_path))
+
+    table = ds.dataset(str(tmp_path), partitioning='hive').to_table()
+    assert table.num_rows == 3000
+    assert len(set(table.column('video_id').to_pylist())) == 3000
+
+
+def _videos(viewcount):
+    return [{'channel_name': 'channel', 'video_id': 'video', 'title': 'title', 'description': '',
+             'viewcount': viewcount, 'likecount': '1', 'commentcount': '1'}]
+
+
+def test_write_videos_parquet_full_export_replaces_previous_rows(tmp_path):
+    write_videos_parquet(_videos('10'), str(tmp_path))
+    write_videos_parquet(_videos('20'), str(tmp_path))
+
+    table = ds.dataset(str(tmp_path), partitioning='hive').to_table()
+    assert table.column('viewcount').to_pylist() == [20]
+
+
+def test_write_videos_parquet_append_keeps_snapshots(tmp_path):
+    first = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    second = datetime(2024, 1, 2, tzinfo=timezone.utc)
+    write_videos_parquet(_videos('10'), str(tmp_path), append=True, snapshot_at=first)
+    write_videos_parquet(_videos('20'), str(tmp_path), append=True, snapshot_at=second)
+
+    rows = ds.dataset(str(tmp_path), partitioning='hive').to_table().to_pylist()
+    assert sorted((row['snapshot_at'], row['viewcount']) for row in rows) == [(first, 10), (second, 20)]
@@ -0,0 +1,27 @@
+import os
+
+os.environ.setdefault('API_KEY_YOUTUBE_API', 'test')
+
+import youtube_api_requests as ytapi
+from pipeline import Pipeline
+from sync_state import SyncState
+
+
+def test_page_playlist_refreshes_recent_count_known_videos(tmp_path, monkeypatch):
+    state = SyncState(str(tmp_path / 'sync_state.json'))
+    known = [{'videoId': f"known{index}", 'videoPublishedAt': f"2024-01-0{index + 1}T00:00:00Z"} for index in range(3)]
+    state.update_channel('UUchannel', known[::-1], recent_count=3)
+    new = [{'videoId': f"new{index}", 'videoPublishedAt': f"2024-02-0{index + 1}T00:00:00Z"} for index in range(3)]
+
+    def fake_pages(playlist_task, on_complete=None):
+        yield new[::-1]
+        on_complete()
+
+    monkeypatch.setattr(ytapi, 'iter_playlist_pages', fake_pages)
+    pipeline = Pipeline([], state=state, recent_count=3)
+    batches = list(pipeline._page_playlist({'channel_name': 'channel', 'uploads_playlist_id': 'UUchannel'}))
+
+    video_ids = [video_id for batch, _ in batches for video_id in batch]
+    # Same videos as get_videos_info: the new ones plus the `recent_count` latest known ones
+    assert sorted(video_ids) == sorted(['new0', 'new1', 'new2', 'known0', 'known1', 'known2'])
+    assert state.get_recent_video_ids('UUchannel') == ['new2', 'new1', 'new0']
@@ -0,0 +1,19 @@
+import time
+
+import pytest
+
+from quota_scheduler import TokenBucket
+
+
+def test_token_bucket_below_one_token_per_second():
+    bucket = TokenBucket(0.5)
+    started_at = time.monotonic()
+    # The bucket starts full with one token
+    bucket.acquire()
+    assert time.monotonic() - started_at < 0.5
+
+
+@pytest.mark.parametrize('rate', [0, -1])
+def test_token_bucket_rejects_non_positive_rate(rate):
+    with pytest.raises(ValueError):
+        TokenBucket(rate)
@@ -0,0 +1,121 @@
+import os
+import types
+from datetime import datetime, timezone
+
+os.environ.setdefault('API_KEY_YOUTUBE_API', 'test')
+
+import pytest
+
+import queue_worker
+import work_queue
+import youtube_api_requests as ytapi
+from quota_scheduler import QuotaExceeded
+from work_queue import WorkQueue
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(work_queue, 'time', types.SimpleNamespace(time=clock.time))
+    return clock
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'), lease_seconds=60, max_attempts=3)
+    yield queue
+    queue.close()
+
+
+def _status(queue, key):
+    return queue.connection.execute("SELECT status FROM tasks WHERE key = ?", (key,)).fetchone()[0]
+
+
+def test_expired_lease_is_taken_over(queue, clock):
+    queue.enqueue([queue_worker.channel_task(['UC1'])])
+    task = queue.lease('worker-1')
+    assert queue.lease('worker-2') is None
+
+    clock.now += 61
+    taken_over = queue.lease('worker-2')
+    assert taken_over.key == task.key and taken_over.attempts == 2
+    # The first worker lost its lease
+    assert not queue.extend_lease(task, 'worker-1')
+    assert queue.extend_lease(taken_over, 'worker-2')
+
+
+def test_completing_twice_does_not_fan_out_twice(queue, clock):
+    queue.enqueue([queue_worker.channel_task(['UC1'])])
+    task = queue.lease('worker-1')
+    clock.now += 61
+    taken_over = queue.lease('worker-2')
+    follow_ups = [queue_worker.playlist_page_task('UU1', 'channel')]
+
+    assert queue.complete(taken_over, follow_ups)
+    follow_up = queue.lease('worker-2')
+    assert queue.complete(follow_up)
+    # The late worker completes the same task: its follow-ups are not enqueued again, although they are done
+    assert not queue.complete(task, follow_ups)
+    assert queue.lease('worker-1') is None
+    assert queue.is_drained()
+
+
+def test_failed_task_is_retried_after_a_backoff(queue, clock):
+    queue.enqueue([queue_worker.channel_task(['UC1'])])
+    task = queue.lease('worker-1')
+    queue.fail(task, 'worker-1', 'HttpError 500')
+
+    assert _status(queue, task.key) == work_queue.PENDING
+    assert queue.lease('worker-1') is None
+    clock.now += 2 ** task.attempts
+    assert queue.lease('worker-1').attempts == 2
+
+
+def test_task_fails_after_max_attempts(queue, clock):
+    queue.enqueue([queue_worker.channel_task(['UC1'])])
+    for attempt in range(1, 4):
+        task = queue.lease('worker-1')
+        assert task.attempts == attempt
+        queue.fail(task, 'worker-1', 'HttpError 500')
+        clock.now += 2 ** attempt
+
+    assert _status(queue, task.key) == work_queue.FAILED
+    assert queue.lease('worker-1') is None
+    assert queue.is_drained()
+
+    assert queue.retry_failed() == 1
+    assert queue.lease('worker-1').attempts == 1
+
+
+def test_task_fails_after_max_expired_leases(queue, clock):
+    queue.enqueue([queue_worker.channel_task(['UC1'])])
+    for _ in range(3):
+        task = queue.lease('worker-1')
+        clock.now += 61
+
+    assert queue.lease('worker-2') is None
+    assert _status(queue, task.key) == work_queue.FAILED
+
+
+def test_quota_exceeded_releases_the_task_to_the_other_workers(queue, monkeypatch):
+    queue.enqueue([queue_worker.channel_task(['UC1'])])
+
+    def quota_exceeded(payload):
+        raise QuotaExceeded(datetime(2024, 1, 1, 8, tzinfo=timezone.utc))
+
+    monkeypatch.setitem(queue_worker.TASK_HANDLERS, 'channel', quota_exceeded)
+    # Restored after the test, run_worker turns it off
+    monkeypatch.setattr(ytapi.scheduler, 'wait_for_reset', ytapi.scheduler.wait_for_reset)
+    assert queue_worker.run_worker(queue, None, 'worker-1') == 0
+
+    # Available right away, and the attempt is not counted
+    task = queue.lease('worker-2')
+    assert task is not None and task.attempts == 1
@@ -0,0 +1,257 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_PATH = 'work_queue.sqlite'
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 5
+
+# Task kinds, in the order they are leased: the deepest tasks first, so that the queue drains
+# towards the outputs instead of fanning out every channel before any comment is fetched
+TASK_KINDS = ('comment-page', 'video-batch', 'playlist-page', 'channel')
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Task:
+    """
+    A task leased from the queue.
+    """
+    __slots__ = ('key', 'kind', 'payload', 'attempts')
+
+    def __init__(self, key, kind, payload, attempts):
+        self.key = key
+        self.kind = kind
+        self.payload = payload
+        self.attempts = attempts
+
+    def __repr__(self):
+        return f"Task({self.key!r}, attempts={self.attempts})"
+
+
+class WorkQueue:
+    """
+    Durable work queue stored in a SQLite file, shared by the worker processes of "queue_worker.py".
+
+    Each task is identified by a key derived from what it fetches (e.g. 'comment-page:<video ID>:<page>'),
+    so enqueueing the same task twice is a no-op. A worker leases a task for `lease_seconds`; if the worker
+    crashes, the lease expires and another worker takes the task over. Completing a task marks it done and
+    enqueues its follow-up tasks in the same transaction, and is ignored if the task is already done, so a task
+    completed twice after a lease expiry does not fan out twice. Failed tasks are retried with an exponential
+    backoff, up to `max_attempts` times.
+
+    Workers on several nodes can share the queue through a network file system supporting SQLite locking.
+    """
+
+    def __init__(self, path=DEFAULT_QUEUE_PATH, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """
+        Params:
+            path (str): The path of the SQLite file, created if needed.
+            lease_seconds (float): How long a leased task is reserved for its worker.
+            max_attempts (int): The number of leases of a task before it is marked as failed.
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        self.lock = threading.Lock()
+        # Transactions are managed explicitly, with BEGIN IMMEDIATE so that two workers never lease the same task
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self._transaction() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                " key TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, status TEXT NOT NULL,"
+                " priority INTEGER NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, available_at REAL NOT NULL,"
+                " lease_owner TEXT, lease_expires_at REAL, last_error TEXT, updated_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS tasks_ready ON tasks (status, priority, available_at)")
+
+    @contextmanager
+    def _transaction(self):
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    @staticmethod
+    def _insert(connection, tasks, now):
+        connection.executemany(
+            "INSERT OR IGNORE INTO tasks (key, kind, payload, status, priority, available_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(key, kind, json.dumps(payload), PENDING, TASK_KINDS.index(kind), now, now) for kind, key, payload in tasks]
+        )
+
+    def enqueue(self, tasks):
+        """
+        Adds tasks to the queue, ignoring the ones already known (pending, running, done or failed).
+
+        Params:
+            tasks (list): (kind, key, payload) tuples, `payload` being a JSON-serializable dictionary.
+        """
+        with self._transaction() as connection:
+            self._insert(connection, tasks, time.time())
+
+    def lease(self, worker_id, kinds=TASK_KINDS):
+        """
+        Leases the next available task: a pending task whose retry delay is over, or a task whose lease expired.
+
+        Params:
+            worker_id (str): The identifier of the worker, which must be passed to "complete" and "fail".
+            kinds (tuple): The task kinds the worker accepts.
+
+        Returns:
+            Task or None: The leased task, None if no task is available right now.
+        """
+        placeholders = ','.join('?' * len(kinds))
+        with self._transaction() as connection:
+            while True:
+                now = time.time()
+                row = connection.execute(
+                    "SELECT key, kind, payload, attempts FROM tasks"
+                    f" WHERE kind IN ({placeholders})"
+                    "  AND ((status = ? AND available_at <= ?) OR (status = ? AND lease_expires_at <= ?))"
+                    " ORDER BY priority, available_at LIMIT 1",
+                    (*kinds, PENDING, now, LEASED, now)
+                ).fetchone()
+                if row is None:
+                    return None
+
+                key, kind, payload, attempts = row
+                if attempts >= self.max_attempts:
+                    # A task whose worker keeps dying, e.g. out of memory, must not block the queue forever
+                    connection.execute(
+                        "UPDATE tasks SET status = ?, last_error = COALESCE(last_error, 'lease expired'), updated_at = ?"
+                        " WHERE key = ?", (FAILED, now, key))
+                    logger.error(f"Task {key} failed after {attempts} attempts")
+                    continue
+
+                connection.execute(
+                    "UPDATE tasks SET status = ?, attempts = attempts + 1, lease_owner = ?, lease_expires_at = ?,"
+                    " updated_at = ? WHERE key = ?",
+                    (LEASED, worker_id, now + self.lease_seconds, now, key))
+                return Task(key, kind, json.loads(payload), attempts + 1)
+
+    def extend_lease(self, task, worker_id):
+        """
+        Extends the lease of a long-running task. Returns False if the worker lost the lease.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE tasks SET lease_expires_at = ?, updated_at = ? WHERE key = ? AND status = ? AND lease_owner = ?",
+                (now + self.lease_seconds, now, task.key, LEASED, worker_id))
+            return cursor.rowcount == 1
+
+    def complete(self, task, follow_ups=()):
+        """
+        Marks a task as done and enqueues its follow-up tasks, atomically. Completing a task that is already done,
+        e.g. by a worker whose lease expired, is a no-op.
+
+        Params:
+            task (Task): The leased task.
+            follow_ups (list): The (kind, key, payload) tuples of the tasks to run next.
+
+        Returns:
+            bool: Whether the task was completed by this call.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE tasks SET status = ?, lease_owner = NULL, lease_expires_at = NULL, last_error = NULL,"
+                " updated_at = ? WHERE key = ? AND status != ?",
+                (DONE, now, task.key, DONE))
+            if cursor.rowcount == 0:
+                return False
+            self._insert(connection, follow_ups, now)
+        return True
+
+    def fail(self, task, worker_id, error):
+        """
+        Releases a task that failed, to be retried after an exponential backoff, or marks it as failed
+        after `max_attempts` attempts.
+
+        Params:
+            task (Task): The leased task.
+            worker_id (str): The identifier of the worker holding the lease.
+            error (str): A description of the error.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            if task.attempts >= self.max_attempts:
+                connection.execute(
+                    "UPDATE tasks SET status = ?, lease_owner = NULL, lease_expires_at = NULL, last_error = ?,"
+                    " updated_at = ? WHERE key = ? AND lease_owner = ?",
+                    (FAILED, error, now, task.key, worker_id))
+                logger.error(f"Task {task.key} failed after {task.attempts} attempts: {error}")
+            else:
+                connection.execute(
+                    "UPDATE tasks SET status = ?, available_at = ?, lease_owner = NULL, lease_expires_at = NULL,"
+                    " last_error = ?, updated_at = ? WHERE key = ? AND lease_owner = ?",
+                    (PENDING, now + 2 ** task.attempts, error, now, task.key, worker_id))
+
+    def release(self, task, worker_id, error=None):
+        """
+        Gives a leased task back to the queue without counting the attempt, available to the other workers
+        right away, e.g. when the worker cannot run it anymore because the quota of its API key is spent.
+
+        Params:
+            task (Task): The leased task.
+            worker_id (str): The identifier of the worker holding the lease.
+            error (str): Optional description of why the task was released.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE tasks SET status = ?, attempts = attempts - 1, available_at = ?, lease_owner = NULL,"
+                " lease_expires_at = NULL, last_error = COALESCE(?, last_error), updated_at = ?"
+                " WHERE key = ? AND lease_owner = ? AND status = ?",
+                (PENDING, now, error, now, task.key, worker_id, LEASED))
+
+    def counts(self):
+        """
+        Returns the number of tasks per kind and status, e.g. {'comment-page': {'done': 120, 'pending': 3}}.
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT kind, status, COUNT(*) FROM tasks GROUP BY kind, status").fetchall()
+        counts = {}
+        for kind, status, count in rows:
+            counts.setdefault(kind, {})[status] = count
+        return counts
+
+    def is_drained(self):
+        """
+        Returns whether no task is pending or leased anymore.
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT COUNT(*) FROM tasks WHERE status IN (?, ?)", (PENDING, LEASED)).fetchone()
+        return row[0] == 0
+
+    def retry_failed(self):
+        """
+        Puts the failed tasks back in the queue with a fresh attempt count, e.g. after fixing their cause.
+
+        Returns:
+            int: The number of tasks requeued.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE tasks SET status = ?, attempts = 0, available_at = ?, updated_at = ? WHERE status = ?",
+                (PENDING, now, now, FAILED))
+            return cursor.rowcount
+
+    def close(self):
+        self.connection.close()
@@ -1,13 +1,31 @@
+"""
+Extraction of YouTube channels, videos and comments with the YouTube Data API.
+
+The get_*/iter_* functions (get_channel_info, get_videos_info, get_video_comments, ...) run a whole extraction
+stage. The pipelined and distributed modes ("pipeline.py", "queue_worker.py") are built from the same steps:
+
+- one API page per call, errors raised: fetch_channels, fetch_playlist_page, fetch_videos,
+  fetch_comment_threads_page, fetch_replies_page;
+- the records of a page: build_channel_info, build_videos_batch, build_comments, threads_missing_replies;
+- one playlist, batch of videos or video at a time, errors logged: channel_playlist_task, iter_playlist_pages,
+  video_batches, get_videos_batch, delta_sync, iter_comments_of_video, get_comments_of_videos_batch;
+- helpers: init_worker, create_executor, chunks, ichunks, log_http_error, error_class.
+"""
 import os
-import google_auth_oauthlib.flow
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-import pprint
 import json
-import pandas as pd
 import logging
+import threading
 import time
+from collections import deque
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from quota_scheduler import (QuotaScheduler, QUOTA_COSTS, DEFAULT_DAILY_BUDGET, DEFAULT_REQUESTS_PER_SECOND,
+                             QUOTA_ERROR_REASONS, RATE_LIMIT_ERROR_REASONS, QuotaExceeded, http_error_reason)
+from metrics import run_metrics
+from records import ChannelRecord, CommentRecord, VideoRecord
+from response_cache import ResponseCache, CacheMiss, DEFAULT_MAX_BYTES
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -18,136 +36,666 @@ load_dotenv()
 API_SERVICE_NAME = "youtube"
 API_VERSION = "v3"
 API_KEY = os.getenv('API_KEY_YOUTUBE_API')
+API_ENDPOINT = os.getenv('YOUTUBE_API_ENDPOINT')
+MAX_IDS_PER_REQUEST = 50  # Maximum number of comma-separated IDs accepted by the list endpoints
+DEFAULT_RECENT_VIDEOS = 20  # Latest videos per channel whose statistics are refreshed in incremental mode
+DEFAULT_BATCH_SIZE = 50  # First-page comment requests coalesced in one batch HTTP exchange
+
+# Partial-response masks: each request only asks for the fields read by the record builders below.
+# Keep them in sync with build_channel_info, _get_playlist_videos, _build_video_info, build_comments and _build_reply.
+# The responses are also gzip-compressed: httplib2 sends "Accept-Encoding: gzip" and the client adds "(gzip)"
+# to the User-Agent, which the API requires before compressing.
+_COMMENT_FIELDS = 'id,snippet(textOriginal,publishedAt,likeCount,parentId)'
+FIELD_MASKS = {
+    'channels.list': 'items(id,snippet(title,description),statistics(viewCount,subscriberCount,videoCount),'
+                     'contentDetails/relatedPlaylists/uploads)',
+    'playlistItems.list': 'nextPageToken,items/contentDetails(videoId,videoPublishedAt)',
+    'videos.list': 'items(id,snippet(title,description),statistics(viewCount,likeCount,commentCount))',
+    'commentThreads.list': f'nextPageToken,items(id,snippet(totalReplyCount,topLevelComment({_COMMENT_FIELDS})),'
+                           f'replies/comments({_COMMENT_FIELDS}))',
+    'comments.list': f'nextPageToken,items({_COMMENT_FIELDS})',
+}
+
+
+def _build_client():
+    """
+    Create a YouTube Data API client. Each client owns its own httplib2 transport, which is not thread-safe.
+
+    The client is built from the discovery document bundled with google-api-python-client, so no network
+    access is needed. The discovery module is imported here because it is slow to import.
+    """
+    from googleapiclient.discovery import build
+
+    # YOUTUBE_API_ENDPOINT points the client to a stand-in of the API, e.g. the fake server of the benchmarks
+    client_options = {'api_endpoint': API_ENDPOINT} if API_ENDPOINT else None
+    return build(API_SERVICE_NAME, API_VERSION, developerKey=API_KEY, static_discovery=True, cache_discovery=False,
+                 client_options=client_options)
+
+
+# The module client is created on first use, so that importing this module is fast and works offline
+_client = None
+_client_lock = threading.Lock()
 
-# Get credentials and create an API client
-youtube = build(API_SERVICE_NAME, API_VERSION, developerKey=API_KEY)
 
-def get_channel_info(youtube_channels_id):
+def set_api_key(api_key):
     """
-    Get YouTube channel information: title, description, total views count, subscribers count, videos count, the ID of the uploads playlist.
+    Use another API key, e.g. one of a pool of keys each having its own quota. Must be called before the
+    worker threads are started: the clients they already created keep the previous key.
+    """
+    global API_KEY, _client
+    with _client_lock:
+        API_KEY = api_key
+        _client = None
+
+
+def get_client():
+    """
+    Returns the module API client, creating it on the first call.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _build_client()
+    return _client
+
+
+def __getattr__(name):
+    # Keep "youtube_api_requests.youtube" working, the client is now created lazily
+    if name == 'youtube':
+        return get_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Every API call goes through the scheduler, which tracks the daily quota and rate-limits the requests
+scheduler = QuotaScheduler(
+    daily_budget=int(os.getenv('YOUTUBE_DAILY_QUOTA', DEFAULT_DAILY_BUDGET)),
+    requests_per_second=float(os.getenv('YOUTUBE_REQUESTS_PER_SECOND', DEFAULT_REQUESTS_PER_SECOND))
+)
+
+# Optional on-disk cache of the API responses, enabled by YOUTUBE_RESPONSE_CACHE (path of the SQLite file).
+# With YOUTUBE_OFFLINE=1 the cached responses are replayed without any network access.
+response_cache = None
+if os.getenv('YOUTUBE_RESPONSE_CACHE'):
+    response_cache = ResponseCache(
+        path=os.getenv('YOUTUBE_RESPONSE_CACHE'),
+        max_bytes=int(os.getenv('YOUTUBE_RESPONSE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)),
+        offline=os.getenv('YOUTUBE_OFFLINE', '0') == '1'
+    )
+
+# Clients owned by the worker threads of the concurrent mode
+_worker_state = threading.local()
+
+
+def _get_client():
+    """
+    Returns the API client of the current thread: its own client in a worker thread, the module client otherwise.
+    """
+    return getattr(_worker_state, 'youtube', None) or get_client()
+
+
+def init_worker():
+    """
+    Thread pool initializer giving each worker thread its own API client.
+    """
+    _worker_state.youtube = _build_client()
+
+
+def error_class(e):
+    """
+    Returns the class of an error for the run metrics, e.g. 'HttpError 403 commentsDisabled'.
+    """
+    if isinstance(e, HttpError):
+        return f"HttpError {e.resp.status} {http_error_reason(e) or ''}".rstrip()
+    return type(e).__name__
+
+
+def _execute(endpoint, request):
+    """
+    Execute an API request through the response cache, then the quota scheduler, recording it in the run metrics.
 
     Params:
-    youtube_channels_id: list of channel IDs
+        endpoint (str): The endpoint name, e.g. 'videos.list', used to charge its quota cost.
+        request (HttpRequest): The request built by the API client.
 
     Returns:
-    List of dictionaries containing the channel information for all requested channels: title, description, total views count, subscribers count, videos count, the ID of the uploads playlist.
+        dict: The response of the request.
     """
-    youtube_channels_info = []
+    if response_cache is not None:
+        response = response_cache.get(endpoint, request.uri)
+        if response is not None:
+            run_metrics.record_api_call(endpoint, 0, cache_hit=True)
+            return response
+
+    # Measure the size of the response body before it is deserialized (httplib2 already decompressed it)
+    response_bytes = [0]
+    postproc = request.postproc
+
+    def measured_postproc(resp, content):
+        response_bytes[0] += len(content or b'')
+        return postproc(resp, content)
+
+    request.postproc = measured_postproc
+
+    retries = []
+    # The latency only covers the HTTP exchanges, the quota, rate-limit and backoff waits are recorded apart
+    attempts = []
+    error = None
+    started_at = time.perf_counter()
+    try:
+        response = scheduler.execute(endpoint, request, on_retry=retries.append, on_attempt=attempts.append)
+    except Exception as e:
+        error = error_class(e)
+        raise
+    finally:
+        latency = sum(attempts)
+        run_metrics.record_api_call(endpoint, latency, response_bytes[0], len(retries),
+                                    QUOTA_COSTS.get(endpoint, 1) * (len(retries) + 1), error,
+                                    wait=time.perf_counter() - started_at - latency)
 
-    for youtube_channel_id in youtube_channels_id:
+    if response_cache is not None:
+        response_cache.put(endpoint, request.uri, response)
+    return response
+
+
+def create_executor(max_workers):
+    """
+    Create the thread pool used by the concurrent mode.
+
+    Params:
+        max_workers (int): The number of worker threads. With 1 or less, everything runs serially in the calling thread.
+
+    Returns:
+        ThreadPoolExecutor or None: None when the work should run serially.
+    """
+    if max_workers is None or max_workers <= 1:
+        return None
+    return ThreadPoolExecutor(max_workers=max_workers, initializer=init_worker, thread_name_prefix='ytapi')
+
+
+def _map(executor, func, items):
+    """
+    Apply `func` to every element of `items`, on the worker threads of `executor` if there is one.
+
+    Returns:
+        list: The results, in the order of `items`.
+    """
+    if executor is None:
+        return [func(item) for item in items]
+    return list(executor.map(func, items))
+
+
+def _imap(executor, func, items, window):
+    """
+    Lazily apply `func` to the elements of `items` on the worker threads of `executor`, keeping at most
+    `window` calls in flight so that the results waiting to be consumed stay bounded.
+
+    Yields:
+        The results, in the order of `items`.
+    """
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def chunks(items, size):
+    """
+    Split a list into consecutive chunks of at most `size` elements.
+
+    Params:
+        items (list): The list to split.
+        size (int): The maximum length of each chunk.
+
+    Returns:
+        generator: Yields lists of at most `size` elements, in the original order.
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def ichunks(items, size):
+    """
+    Lazy counterpart of "chunks" for any iterable, e.g. a generator of videos.
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def log_http_error(e, context):
+    """
+    Log the message contained in an HttpError returned by the YouTube API.
+
+    Params:
+        e (HttpError): The error raised by the API client.
+        context (str): A description of the request that failed, e.g. "video ID abc".
+    """
+    try:
+        error_details = json.loads(e.content.decode('utf-8'))
+        error_message = error_details.get('error', {}).get('message', 'An unknown error occurred')
+        logger.error(f"HTTP error {e.resp.status} occurred for {context}: {error_message}")
+    except json.JSONDecodeError as parse_error:
+        logger.error(f"Failed to parse error response for {context}: {parse_error}")
+        logger.error(f"Raw error content: {e.content}")
+
+
+def build_channel_info(item):
+    """
+    Build the channel record from an item of a channels.list response.
+
+    Params:
+        item (dict): A channel resource returned by the YouTube API.
+
+    Returns:
+        dict: The channel details, see "get_channel_info".
+    """
+    snippet = item.get('snippet', {})
+    statistics = item.get('statistics', {})
+
+    return {
+        'channel_id': item.get('id', ''),
+        'channel_name': snippet.get('title', 'Unknown'),
+        'description': snippet.get('description', 'No description available'),
+        'viewcount': statistics.get('viewCount', '0'),
+        'subscribers': statistics.get('subscriberCount', '0'),
+        'videocount': statistics.get('videoCount', '0'),
+        'uploads_playlist_id': item.get('contentDetails', {}).get('relatedPlaylists', {}).get('uploads', 'Unknown')
+    }
+
+
+def fetch_channels(channel_ids):
+    """
+    Fetch at most MAX_IDS_PER_REQUEST channels in a single channels.list call.
+
+    Returns:
+        dict: The channels.list response, whose items are in no particular order.
+    """
+    request = _get_client().channels().list(
+        part="snippet,contentDetails,statistics",
+        id=','.join(channel_ids),
+        maxResults=len(channel_ids),
+        fields=FIELD_MASKS['channels.list']
+    )
+    return _execute('channels.list', request)
+
+
+def resolve_channels(youtube_channels_id):
+    """
+    Look up a list of YouTube channels, MAX_IDS_PER_REQUEST channels per API call.
+
+    Params:
+        youtube_channels_id (list): A list of channel IDs.
+
+    Returns:
+        tuple: (found, not_found) where `found` maps each resolved channel ID to its channel information
+               (see "get_channel_info") and `not_found` lists the IDs the API did not return.
+               IDs of batches that failed with an error are in neither.
+    """
+    found = {}
+    not_found = []
+
+    for batch in chunks(youtube_channels_id, MAX_IDS_PER_REQUEST):
         try:
-            request = youtube.channels().list(
-                part="snippet,contentDetails,statistics",
-                id=youtube_channel_id
-            )
-            response = request.execute()
-
-            # Check if no channels were found
-            if response.get('pageInfo', {}).get('totalResults', 0) == 0:
-                logger.error(f"No channel found with ID: {youtube_channel_id}")
-                continue  # Skip to the next ID
-
-            # Process the response if a channel is found
-            items = response.get('items', [])
-            if items:
-                item = items[0]
-                snippet = item.get('snippet', {})
-                channel_info = {
-                    'channel_name': snippet.get('title', 'Unknown'),
-                    'description': snippet.get('description', 'No description available'),
-                    'viewcount': item.get('statistics', {}).get('viewCount', '0'),
-                    'subscribers': item.get('statistics', {}).get('subscriberCount', '0'),
-                    'videocount': item.get('statistics', {}).get('videoCount', '0'),
-                    'uploads_playlist_id': item.get('contentDetails', {}).get('relatedPlaylists', {}).get('uploads', 'Unknown')
-                }
-                youtube_channels_info.append(channel_info)
-                logger.info(f"Channel found: {channel_info['channel_name']}")
+            response = fetch_channels(batch)
 
         except HttpError as e:
-            try:
-                error_details = json.loads(e.content.decode('utf-8'))
-                error_message = error_details.get('error', {}).get('message', 'An unknown error occurred')
-                logger.error(f"HTTP error {e.resp.status} occurred for channel ID {youtube_channel_id}: {error_message}")
-            except json.JSONDecodeError as parse_error:
-                logger.error(f"Failed to parse error response for channel ID {youtube_channel_id}: {parse_error}")
-                logger.error(f"Raw error content: {e.content}")
+            log_http_error(e, f"channel IDs {', '.join(batch)}")
+            continue
 
         except Exception as e:
-            logger.error(f"An unexpected error occurred with channel ID {youtube_channel_id}: {e}")
+            logger.error(f"An unexpected error occurred with channel IDs {', '.join(batch)}: {e}")
+            continue
+
+        # Unknown IDs are silently omitted from the items, compare against the batch instead of pageInfo.totalResults
+        items_by_id = {item.get('id'): item for item in response.get('items', [])}
+        for youtube_channel_id in batch:
+            item = items_by_id.get(youtube_channel_id)
+            if item is None:
+                not_found.append(youtube_channel_id)
+            else:
+                found[youtube_channel_id] = build_channel_info(item)
+
+    return found, not_found
+
+
+def get_channel_info(youtube_channels_id, cache=None, as_records=False):
+    """
+    Get YouTube channel information: title, description, total views count, subscribers count, videos count, the ID of the uploads playlist.
+
+    Params:
+    youtube_channels_id: list of channel IDs
+    cache: optional channel_cache.ChannelCache. Channels found in the cache are not requested again,
+           channels fetched from the API are added to it and the cache is saved.
+    as_records: return records.ChannelRecord objects, with typed counts, instead of dictionaries.
 
+    Returns:
+    List of dictionaries containing the channel information for all requested channels: channel ID, title, description, total views count, subscribers count, videos count, the ID of the uploads playlist.
+    """
+    youtube_channels_id = list(dict.fromkeys(youtube_channels_id))  # Drop duplicates, keep the order
+    channels_by_id = {}
+
+    if cache is not None:
+        for youtube_channel_id in youtube_channels_id:
+            channel_info = cache.get(youtube_channel_id)
+            if channel_info is not None:
+                channels_by_id[youtube_channel_id] = channel_info
+
+    missing_ids = [youtube_channel_id for youtube_channel_id in youtube_channels_id if youtube_channel_id not in channels_by_id]
+    if missing_ids:
+        found, not_found = resolve_channels(missing_ids)
+        for youtube_channel_id in not_found:
+            logger.error(f"No channel found with ID: {youtube_channel_id}")
+
+        channels_by_id.update(found)
+        if cache is not None and found:
+            for youtube_channel_id, channel_info in found.items():
+                cache.put(youtube_channel_id, channel_info)
+            cache.save()
+
+    youtube_channels_info = []
+    for youtube_channel_id in youtube_channels_id:
+        channel_info = channels_by_id.get(youtube_channel_id)
+        if channel_info is not None:
+            youtube_channels_info.append(channel_info)
+            logger.info(f"Channel found: {channel_info['channel_name']}")
+
+    if as_records:
+        return [ChannelRecord.from_dict(channel_info) for channel_info in youtube_channels_info]
     return youtube_channels_info
 
 
-def get_videos_id(uploads_playlist_id):
+
+
+def fetch_playlist_page(uploads_playlist_id, page_token=None):
+    """
+    Fetch one page of the items of a playlist.
+
+    Params:
+        uploads_playlist_id (str): The id of the playlist.
+        page_token (str): The token of the page to fetch, None for the first page.
+
+    Returns:
+        dict: The playlistItems.list response.
+    """
+    request = _get_client().playlistItems().list(
+        part='contentDetails',
+        playlistId=uploads_playlist_id,
+        maxResults=50,
+        pageToken=page_token,
+        fields=FIELD_MASKS['playlistItems.list']
+    )
+    return _execute('playlistItems.list', request)
+
+
+def iter_playlist_pages(playlist_task, on_complete=None):
+    """
+    Page through an uploads playlist, newest videos first, optionally stopping at a publication date.
+
+    Params:
+        playlist_task (tuple): (uploads_playlist_id, published_after, channel_name). When `published_after` is set,
+                               only the videos published after it are yielded, and the paging stops at the first
+                               page reaching a video published at or before it. The quota spent is attributed to
+                               `channel_name` in the run metrics.
+        on_complete (callable): Called once all the pages were fetched without error.
+
+    Yields:
+        list: The contentDetails ('videoId', 'videoPublishedAt') of the videos of each page.
+    """
+    uploads_playlist_id, published_after, channel_name = playlist_task
+
+    try:
+        next_page_token = None
+        more_pages = True
+
+        while more_pages:
+            with run_metrics.scope(channel_name):
+                response = fetch_playlist_page(uploads_playlist_id, next_page_token)
+
+            videos_id_date = []
+            reached_watermark = False
+            for item in response.get('items', []):
+                content_details = item.get('contentDetails', {})
+                if published_after and not content_details.get('videoPublishedAt'):
+                    # Private or deleted videos have no publication date, they say nothing about the watermark
+                    continue
+                # ISO 8601 UTC timestamps compare chronologically as strings
+                if published_after and content_details['videoPublishedAt'] <= published_after:
+                    reached_watermark = True
+                    continue
+                videos_id_date.append(content_details)
+            yield videos_id_date
+
+            next_page_token = response.get('nextPageToken')
+            more_pages = next_page_token is not None and not reached_watermark
+
+    except HttpError as e:
+        log_http_error(e, f"playlist ID {uploads_playlist_id}")
+        return
+
+    except Exception as e:
+        logger.error(f"An unexpected error occurred with playlist ID {uploads_playlist_id}: {e}")
+        return
+
+    if on_complete is not None:
+        on_complete()
+
+
+def _get_playlist_videos(playlist_task):
+    """
+    Page through an uploads playlist, see "iter_playlist_pages".
+
+    Params:
+        playlist_task (tuple): (uploads_playlist_id, published_after, channel_name).
+
+    Returns:
+        tuple: (videos_id_date, complete) where `complete` is False if the paging was interrupted by an error.
+    """
+    complete = []
+    videos_id_date = [video for page in iter_playlist_pages(playlist_task, on_complete=lambda: complete.append(True))
+                     for video in page]
+    return videos_id_date, bool(complete)
+
+
+def get_videos_id(uploads_playlist_id, published_after=None):
     """
     Get the id and publication date of a youtube videos uploaded by a specified youtube channel based on the youtube playlist id. 
 
     Params:  
-    The id of the uploads playlist of a youtube channel. 
+    uploads_playlist_id: The id of the uploads playlist of a youtube channel. 
+    published_after: optional ISO 8601 timestamp. Only the videos published after it are returned, and since the
+                     uploads playlist is ordered newest first, the paging stops as soon as an older video is reached.
     
     Returns:
     A list of dictionaries containing the id and the publication date of a youtube channel uploaded videos. 
     """
-    videos_id_date = []
-    
-    try: 
+    videos_id_date, _ = _get_playlist_videos((uploads_playlist_id, published_after, None))
+    return videos_id_date
 
-        request = youtube.playlistItems().list(
-            part="snippet,contentDetails",
-            maxResults=50,
-            playlistId=uploads_playlist_id,
-        )
-        response = request.execute()
-        items = response.get('items', [{}])
+def _build_video_info(item, channel_name):
+    """
+    Build the video record from an item of a videos.list response.
 
-        for item in items: 
-            videos_id_date.append(item.get('contentDetails', {}))
+    Params:
+        item (dict): A video resource returned by the YouTube API.
+        channel_name (str): The name of the channel the video belongs to.
 
-        next_page_token = response.get('nextPageToken')
-        more_pages = True
+    Returns:
+        dict: The video details, see "get_videos_info".
+    """
+    snippet = item.get('snippet', {})
+    statistics = item.get('statistics', {})
 
-        while more_pages:
-            if next_page_token is None:
-                more_pages = False
-            else:
-                request = youtube.playlistItems().list(
-                            part='contentDetails',
-                            playlistId = uploads_playlist_id,
-                            maxResults = 50,
-                            pageToken = next_page_token)
-                response = request.execute()
-                items = response.get('items', [{}])
+    return {
+        'channel_name': channel_name,
+        'video_id': item.get('id', ''),
+        'title': snippet.get('title', ''),
+        'description': snippet.get('description', ''),
+        'viewcount': statistics.get('viewCount', '0'),
+        'likecount': statistics.get('likeCount', '0'),
+        'commentcount': statistics.get('commentCount', '0')
+    }
+
+
+def get_videos_batch(batch_task):
+    """
+    Fetch the details of at most MAX_IDS_PER_REQUEST videos in a single videos.list call.
+
+    Params:
+        batch_task (tuple): (video_ids, channel_name).
 
-                for item in items: 
-                    videos_id_date.append(item.get('contentDetails', {}))
+    Returns:
+        list: The video details, in the order of `video_ids`. Missing, private or deleted videos are logged and left out.
+    """
+    batch, channel_name = batch_task
 
-                next_page_token = response.get('nextPageToken')
+    try:
+        with run_metrics.scope(channel_name):
+            response = fetch_videos(batch)
 
     except HttpError as e:
-        try:
-            error_details = json.loads(e.content.decode('utf-8'))
-            error_message = error_details.get('error', {}).get('message', 'An unknown error occurred')
-            logger.error(f"HTTP error {e.resp.status} occurred for channel ID {uploads_playlist_id}: {error_message}")
-        except json.JSONDecodeError as parse_error:
-            logger.error(f"Failed to parse error response for channel ID {uploads_playlist_id}: {parse_error}")
-            logger.error(f"Raw error content: {e.content}")
+        log_http_error(e, f"video IDs {batch[0]}..{batch[-1]}")
+        return []
 
     except Exception as e:
-        logger.error(f"An unexpected error occurred with playlist ID {uploads_playlist_id}: {e}")
+        logger.error(f"An unexpected error occurred with video IDs {batch[0]}..{batch[-1]}: {e}")
+        return []
 
+    return build_videos_batch(batch, response, channel_name)
 
-    return videos_id_date
 
-def get_videos_info(youtube_channels_info):
+def fetch_videos(video_ids):
+    """
+    Fetch the details of at most MAX_IDS_PER_REQUEST videos in a single videos.list call.
+
+    Returns:
+        dict: The videos.list response, whose items are in no particular order.
+    """
+    request = _get_client().videos().list(
+        part="snippet,statistics",
+        id=','.join(video_ids),  # maxResults is not supported with id, the IDs already bound the result size
+        fields=FIELD_MASKS['videos.list']
+    )
+    return _execute('videos.list', request)
+
+
+def build_videos_batch(video_ids, response, channel_name):
+    """
+    Build the video details of a videos.list response, in the order of `video_ids`.
+    Missing, private or deleted videos are logged and left out.
+    """
+    videos_info = []
+    # The API does not guarantee the order of the items, and silently omits unknown IDs
+    items_by_id = {item.get('id'): item for item in response.get('items', [])}
+    for video_id in video_ids:
+        item = items_by_id.get(video_id)
+        if item is None:
+            logger.warning(f"No items found for video ID {video_id}")
+            continue
+        videos_info.append(_build_video_info(item, channel_name))
+
+    return videos_info
+
+
+def video_batches(video_ids, channel_name):
+    """
+    Group video IDs into the (video_ids, channel_name) tasks of "get_videos_batch".
+    """
+    video_ids = [video_id for video_id in video_ids if video_id]
+    return [(batch, channel_name) for batch in chunks(video_ids, MAX_IDS_PER_REQUEST)]
+
+
+def channel_playlist_task(channel_info, state):
+    """
+    Build the (uploads_playlist_id, published_after, channel_name) task of "_get_playlist_videos" for a channel.
+    """
+    uploads_playlist_id = channel_info.get('uploads_playlist_id', '')  # Get uploads playlist ID for the YouTube channel
+    published_after = state.get_watermark(uploads_playlist_id) if state is not None else None
+    return uploads_playlist_id, published_after, channel_info.get('channel_name')
+
+
+def _channel_video_batches(channel_info, playlist_result, state, recent_count):
+    """
+    Build the video batches of a channel from the result of "_get_playlist_videos", updating the incremental state.
+
+    Params:
+        channel_info (dict): The channel information, see "get_channel_info".
+        playlist_result (tuple): (videos_id_date, complete) returned by "_get_playlist_videos".
+        state (sync_state.SyncState): The incremental state, or None.
+        recent_count (int): The number of latest known videos whose details are refreshed in incremental mode.
+
+    Returns:
+        list: The (video_ids, channel_name) tasks of "get_videos_batch".
+    """
+    uploads_playlist_id = channel_info.get('uploads_playlist_id', '')
+    videos_id, complete = playlist_result
+    video_ids = [video.get('videoId', '') for video in videos_id]
+
+    if state is not None:
+        # Refresh the statistics of the latest known videos along with the new ones
+        video_ids = list(dict.fromkeys(video_ids + state.get_recent_video_ids(uploads_playlist_id)[:recent_count]))
+        if complete:
+            state.update_channel(uploads_playlist_id, videos_id, recent_count)
+        logger.info(f"{len(videos_id)} new videos for channel {channel_info.get('channel_name', '')}")
+
+    return video_batches(video_ids, channel_info.get('channel_name', ''))
+
+
+def get_videos_details(video_ids, channel_name='', max_workers=1):
+    """
+    Fetches the details of a list of YouTube videos, MAX_IDS_PER_REQUEST videos per API call.
+
+    Params:
+        video_ids (list): A list of YouTube video IDs.
+        channel_name (str): The name of the channel the videos belong to, copied in each record.
+        max_workers (int): The number of batches fetched concurrently, each worker using its own API client.
+
+    Returns:
+        list: A list of dictionaries with the video details (see "get_videos_info"), in the order of `video_ids`.
+              Videos that are missing, private or deleted are logged and left out.
+    """
+    executor = create_executor(max_workers)
+    try:
+        results = _map(executor, get_videos_batch, video_batches(video_ids, channel_name))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return [video_info for batch_info in results for video_info in batch_info]
+
+
+def get_videos_info(youtube_channels_info, max_workers=1, state=None, recent_count=DEFAULT_RECENT_VIDEOS, as_records=False):
     """
     Fetches information about YouTube videos from a list of channels.
 
+    The video IDs of each channel are looked up MAX_IDS_PER_REQUEST at a time (see "get_videos_details").
+    With `max_workers` above 1, the uploads playlists of the channels are paged concurrently, then the
+    video batches of all the channels are fetched concurrently, each worker using its own API client.
+
+    With a `state`, the extraction is incremental: the uploads playlist of each channel is only paged down to
+    the high-watermark of the previous run, and details are fetched for the new videos plus the `recent_count`
+    latest known videos, whose statistics are still changing. The state is updated but not saved: save it once
+    the videos are stored, so that the videos of a failed upload are fetched again by the next run.
+    The watermark of a channel whose paging failed is left untouched.
+
     Params:
         youtube_channels_info (list): A list of dictionaries, each containing channel information including the uploads playlist ID. 
                                     The channel information should be retrieved through the function "get_channel_info".
+        max_workers (int): The number of concurrent workers, 1 to run serially.
+        state (sync_state.SyncState): Optional state of the previous runs, enables the incremental mode.
+        recent_count (int): In incremental mode, the number of latest videos per channel whose details are refreshed.
+        as_records (bool): Return records.VideoRecord objects, with typed counts and interned IDs, instead of dictionaries.
 
     Returns:
-        list: A list of dictionaries, each containing details for a video. Each dictionary includes:
+        list: A list of dictionaries, each containing details for a video, in the order of the channels and of their uploads playlists. Each dictionary includes:
             - 'channel_name': The name of the YouTube channel.
             - 'video_id': The unique identifier for the video.
             - 'title': The title of the video.
@@ -156,220 +704,581 @@ def get_videos_info(youtube_channels_info):
             - 'likecount': The number of likes the video has received.
             - 'commentcount': The number of comments the video has received.
     """
+    executor = create_executor(max_workers)
+    try:
+        # Get uploads playlist ID for each YouTube channel, then the videos IDs
+        playlist_tasks = [channel_playlist_task(channel_info, state) for channel_info in youtube_channels_info]
+        channels_videos_id = _map(executor, _get_playlist_videos, playlist_tasks)
 
-    videos_info = []
+        batches = []
+        for channel_info, playlist_result in zip(youtube_channels_info, channels_videos_id):
+            batches.extend(_channel_video_batches(channel_info, playlist_result, state, recent_count))
 
-    for channel_info in youtube_channels_info:
-        uploads_playlist_id = channel_info.get('uploads_playlist_id', '')  # Get uploads playlist ID for each YouTube channel
-        videos_id = get_videos_id(uploads_playlist_id)  # Get videos IDs
+        results = _map(executor, get_videos_batch, batches)
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
-        for video in videos_id:
-            video_id = video.get('videoId', '')
-            try:
-                request = youtube.videos().list(
-                    part="snippet,contentDetails,statistics",
-                    id=video_id
-                )
-                response = request.execute()
-
-                items = response.get('items', [])
-                if not items:
-                    logger.warning(f"No items found for video ID {video_id}")
-                    continue
+    if as_records:
+        return [VideoRecord.from_dict(video_info) for batch_info in results for video_info in batch_info]
+    return [video_info for batch_info in results for video_info in batch_info]
 
-                item = items[0]
-                snippet = item.get('snippet', {})
-                statistics = item.get('statistics', {})
-
-                video_info = {
-                    'channel_name': channel_info.get('channel_name', ''),
-                    'video_id': item.get('id', ''),
-                    'title': snippet.get('title', ''),
-                    'description': snippet.get('description', ''),
-                    'viewcount': statistics.get('viewCount', '0'),
-                    'likecount': statistics.get('likeCount', '0'),
-                    'commentcount': statistics.get('commentCount', '0')
-                }
-                videos_info.append(video_info)
-
-            except HttpError as e:
-                try:
-                    error_details = json.loads(e.content.decode('utf-8'))
-                    error_message = error_details.get('error', {}).get('message', 'An unknown error occurred')
-                    logger.error(f"HTTP error {e.resp.status} occurred for video ID {video_id}: {error_message}")
-                except json.JSONDecodeError as parse_error:
-                    logger.error(f"Failed to parse error response for video ID {video_id}: {parse_error}")
-                    logger.error(f"Raw error content: {e.content}")
-                # Continue to the next video ID after logging the error
-                continue
 
-            except Exception as e:
-                logger.error(f"An unexpected error occurred with video ID {video_id}: {e}")
-                # Continue to the next video ID after logging the error
-                continue
+def iter_videos_info(youtube_channels_info, state=None, recent_count=DEFAULT_RECENT_VIDEOS, as_records=False):
+    """
+    Streaming counterpart of "get_videos_info": yields the video details as each videos.list response arrives,
+    so that only one batch of MAX_IDS_PER_REQUEST videos is held in memory at a time. Runs serially.
 
-    return videos_info
+    Params:
+        youtube_channels_info (list): A list of dictionaries containing channel information, see "get_videos_info".
+        state (sync_state.SyncState): Optional state of the previous runs, enables the incremental mode.
+                                      It is updated but not saved, see "get_videos_info".
+        recent_count (int): In incremental mode, the number of latest videos per channel whose details are refreshed.
+        as_records (bool): Yield records.VideoRecord objects instead of dictionaries.
+
+    Yields:
+        dict: The details of a video, see "get_videos_info".
+    """
+    for channel_info in youtube_channels_info:
+        playlist_result = _get_playlist_videos(channel_playlist_task(channel_info, state))
+        for batch_task in _channel_video_batches(channel_info, playlist_result, state, recent_count):
+            for video_info in get_videos_batch(batch_task):
+                yield VideoRecord.from_dict(video_info) if as_records else video_info
 
 
-def get_video_comments(videos_info):
+def _build_reply(reply, video_id):
     """
-    Fetches comments for a list of YouTube videos based on their IDs.
+    Build the comment record of a reply, from a comment resource returned inline by commentThreads.list or by comments.list.
+    """
+    reply_snippet = reply.get('snippet', {})
+    return {
+        'video_id': video_id,
+        'id': reply.get('id'),
+        'text_original': reply_snippet.get('textOriginal'),
+        'published_at': reply_snippet.get('publishedAt'),
+        'like_count': reply_snippet.get('likeCount', 0),
+        'kind': 'reply',
+        'parentId': reply_snippet.get('parentId'),
+    }
+
+
+def threads_missing_replies(items):
+    """
+    Returns the IDs of the comment threads whose inline replies are incomplete: commentThreads.list only returns
+    a few replies per thread, the others have to be fetched with comments.list.
+    """
+    thread_ids = []
+    for item in items:
+        inline_replies = item.get('replies', {}).get('comments', [])
+        if item.get('snippet', {}).get('totalReplyCount', 0) > len(inline_replies):
+            thread_ids.append(item.get('id'))
+    return thread_ids
+
+
+def build_comments(items, video_id, harvested_replies=None):
+    """
+    Build the comment records from the items of a commentThreads.list response.
 
     Params:
-        videos_info (list): A list of dictionaries, each containing a 'video_id' key with the YouTube video ID.
+        items (list): The comment threads returned by the YouTube API.
+        video_id (str): The ID of the video the comments belong to.
+        harvested_replies (dict): The complete replies fetched with comments.list, by thread ID. They replace
+                                  the inline replies of these threads.
 
     Returns:
-        list: A list of dictionaries, each containing details about a comment. Each dictionary includes:
-            - 'video_id': The unique identifier for the video.
-            - 'text_original': The original text of the comment.
-            - 'published_at': The publication date of the comment.
-            - 'like_count': The number of likes the comment has received.
-            - 'kind': Indicates whether the comment is a 'top level' comment or a 'reply'.
-            - 'parentId' (optional): The ID of the parent comment if the comment is a reply.
+        list: The comments, see "get_video_comments".
     """
     comments = []
-    for video in videos_info:
-        video_id = video.get('video_id', '')
+    harvested_replies = harvested_replies or {}
+
+    for item in items:
+        try:
+            top_level_dic = {}  # Create a new dictionary for each top-level comment
+
+            snippet = item.get('snippet', {})
+            top_level = snippet.get('topLevelComment', {})
+            top_level_comment = top_level.get('snippet', {})
+
+            # Extract the required details
+            top_level_dic['video_id'] = video_id
+            top_level_dic['id'] = top_level.get('id', item.get('id'))
+            top_level_dic['text_original'] = top_level_comment.get('textOriginal')
+            top_level_dic['published_at'] = top_level_comment.get('publishedAt')
+            top_level_dic['like_count'] = top_level_comment.get('likeCount', 0)
+            top_level_dic['kind'] = 'top level'
+            comments.append(top_level_dic)
+
+            # The reply count is a field of the thread, not of its top-level comment
+            if snippet.get('totalReplyCount', 0) != 0:
+                replies = harvested_replies.get(item.get('id'))
+                if replies is None:
+                    replies = item.get('replies', {}).get('comments', [])
+                for reply in replies:
+                    comments.append(_build_reply(reply, video_id))
+        except Exception as e:
+            logger.error(f"An error occurred while processing a comment for video ID {video_id}: {e}")
+            continue
+
+    return comments
+
+
+def fetch_replies_page(parent_id, page_token=None):
+    """
+    Fetch one page of the replies to a top-level comment.
+
+    Params:
+        parent_id (str): The ID of the comment thread, i.e. of its top-level comment.
+        page_token (str): The token of the page to fetch, None for the first page.
+
+    Returns:
+        dict: The comments.list response.
+    """
+    request = _get_client().comments().list(
+        part="snippet",
+        parentId=parent_id,
+        maxResults=100,
+        textFormat='plainText',
+        pageToken=page_token,
+        fields=FIELD_MASKS['comments.list']
+    )
+    return _execute('comments.list', request)
+
+
+def _get_replies_of_thread(parent_id, channel_name=None):
+    """
+    Fetches all the replies to a top-level comment, following the pagination.
+
+    Params:
+        parent_id (str): The ID of the comment thread.
+        channel_name (str): The channel of the video, to which the quota spent is attributed in the run metrics.
+
+    Returns:
+        list or None: The reply resources returned by the API, None if they could not be fetched, in which case
+                      the inline replies of the thread are kept.
+    """
+    replies = []
+    next_page_token = None
+    pages = 0
 
+    while True:
         try:
-            request = youtube.commentThreads().list(
-                part="snippet,replies",
-                videoId=video_id,
-                maxResults=100,
-                order='time'
-            )
-            response = request.execute()
+            with run_metrics.scope(channel_name):
+                response = fetch_replies_page(parent_id, next_page_token)
+            pages += 1
+
         except HttpError as e:
+            log_http_error(e, f"replies of comment {parent_id}")
+            return None
+
+        except QuotaExceeded:
+            # Only raised when the scheduler may not wait for the reset: the caller saves its work instead
+            raise
+
+        except Exception as e:
+            logger.error(f"An unexpected error occurred with the replies of comment {parent_id}: {e}")
+            return None
+
+        replies.extend(response.get('items', []))
+        next_page_token = response.get('nextPageToken')
+        if next_page_token is None:
+            break
+
+    run_metrics.record_pages('comments', pages)
+    return replies
+
+
+def _harvest_replies(thread_ids, channel_name=None, executor=None):
+    """
+    Fetches the complete replies of the comment threads whose inline replies are incomplete.
+
+    Params:
+        thread_ids (list): The IDs of the threads, see "threads_missing_replies".
+        channel_name (str): The channel of the video, to which the quota spent is attributed in the run metrics.
+        executor (ThreadPoolExecutor): The pool fetching the threads concurrently, None to fetch them serially.
+
+    Returns:
+        dict: The reply resources by thread ID, for the threads whose replies could be fetched.
+    """
+    results = _map(executor, partial(_get_replies_of_thread, channel_name=channel_name), thread_ids)
+    return {thread_id: replies for thread_id, replies in zip(thread_ids, results) if replies is not None}
+
+
+def fetch_comment_threads_page(video_id, page_token=None):
+    """
+    Fetch one page of the comment threads of a video, newest first.
+
+    Params:
+        video_id (str): The ID of the video.
+        page_token (str): The token of the page to fetch, None for the first page.
+
+    Returns:
+        dict: The commentThreads.list response.
+    """
+    request = _get_client().commentThreads().list(
+        part="snippet,replies",
+        videoId=video_id,
+        maxResults=100,
+        order='time',
+        pageToken=page_token,
+        fields=FIELD_MASKS['commentThreads.list']
+    )
+    return _execute('commentThreads.list', request)
+
+
+def _new_batch():
+    """
+    Create a batch HTTP request. The batch endpoint of the discovery document ignores YOUTUBE_API_ENDPOINT,
+    so it is derived from it when a stand-in of the API is used.
+    """
+    if API_ENDPOINT:
+        from googleapiclient.http import BatchHttpRequest
+        return BatchHttpRequest(batch_uri=f"{API_ENDPOINT.rstrip('/')}/batch")
+    return _get_client().new_batch_http_request()
+
+
+def _fetch_first_comment_pages(videos):
+    """
+    Fetch the first page of comment threads of several videos in a single batch HTTP exchange.
+
+    Each sub-request is charged its quota units and recorded in the run metrics like a normal call. Videos whose
+    sub-request failed with a quota, rate limit or server error, or whose batch failed, are left out so that
+    they are fetched by the normal paging, which retries them.
+
+    Params:
+        videos (list): The video details, containing their 'video_id' and 'channel_name'.
+
+    Returns:
+        tuple: (first_pages, skipped), the commentThreads.list responses by index in `videos`, and the set of
+               indexes of the videos whose comments cannot be fetched, e.g. disabled comments.
+    """
+    first_pages = {}
+    skipped = set()
+    requests = {}
+
+    for index, video in enumerate(videos):
+        request = _get_client().commentThreads().list(
+            part="snippet,replies",
+            videoId=video.get('video_id', ''),
+            maxResults=100,
+            order='time',
+            fields=FIELD_MASKS['commentThreads.list']
+        )
+        if response_cache is not None:
             try:
-                error_details = json.loads(e.content.decode('utf-8'))
-                error_message = error_details.get('error', {}).get('message', 'An unknown error occurred')
-                logger.error(f"HTTP error {e.resp.status} occurred for video ID {video_id}: {error_message}")
-                if e.resp.status == 403:
-                    logger.error(f"Quota exceeded for the day. Stopping requests until the quota resets.")
-                    # Sleep for 24 hours or until the quota reset time
-                    time.sleep(86400)
-                    continue  # continue the loop after sleeping
-            except json.JSONDecodeError as parse_error:
-                logger.error(f"Failed to parse error response for video ID {video_id}: {parse_error}")
-                logger.error(f"Raw error content: {e.content}")
+                response = response_cache.get('commentThreads.list', request.uri)
+            except CacheMiss:
+                continue  # Left to the normal paging, which reports the miss
+            if response is not None:
+                run_metrics.record_api_call('commentThreads.list', 0, cache_hit=True)
+                first_pages[index] = response
+                continue
+        requests[index] = request
+
+    if not requests:
+        return first_pages, skipped
+
+    response_bytes = {}
+    errors = {}
+
+    def measured_postproc(index, postproc):
+        def postproc_with_size(resp, content):
+            response_bytes[index] = len(content or b'')
+            return postproc(resp, content)
+        return postproc_with_size
+
+    def callback(request_id, response, exception):
+        index = int(request_id)
+        if exception is None:
+            first_pages[index] = response
+            return
+        errors[index] = error_class(exception)
+        reason = http_error_reason(exception)
+        if reason in QUOTA_ERROR_REASONS or reason in RATE_LIMIT_ERROR_REASONS or exception.resp.status >= 500:
+            return
+        log_http_error(exception, f"video ID {videos[index].get('video_id', '')}")
+        skipped.add(index)
+
+    batch = _new_batch()
+    for index, request in requests.items():
+        request.postproc = measured_postproc(index, request.postproc)
+        batch.add(request, callback=callback, request_id=str(index))
+
+    waited_at = time.perf_counter()
+    scheduler.acquire('commentThreads.list', calls=len(requests))
+    started_at = time.perf_counter()
+    wait = started_at - waited_at
+    try:
+        batch.execute()
+    except Exception as e:
+        logger.warning(f"Batch of {len(requests)} comment requests failed, fetching them one by one: {e}")
+        run_metrics.record_api_call('batch', time.perf_counter() - started_at, error=error_class(e), wait=wait)
+        return first_pages, skipped
+    latency = time.perf_counter() - started_at
+    run_metrics.record_api_call('batch', latency, wait=wait)
+
+    for index, request in requests.items():
+        with run_metrics.scope(videos[index].get('channel_name')):
+            run_metrics.record_api_call('commentThreads.list', latency, response_bytes.get(index, 0), 0,
+                                        QUOTA_COSTS['commentThreads.list'], errors.get(index))
+        if response_cache is not None and index in first_pages:
+            response_cache.put('commentThreads.list', request.uri, first_pages[index])
+
+    return first_pages, skipped
+
+
+def _thread_published_at(item):
+    return item.get('snippet', {}).get('topLevelComment', {}).get('snippet', {}).get('publishedAt') or ''
+
+
+def iter_comments_of_video(video_id, channel_name=None, as_records=False, reply_executor=None, first_page=None,
+                           since=None, on_complete=None):
+    """
+    Fetches all the comments of a single video, following the pagination, and yields them page by page.
+
+    The threads of each page having more replies than returned inline get their replies paged with comments.list.
+    Comments are deduplicated by ID, since the pages can shift while new comments are posted.
+
+    With `since`, only the threads published after it are yielded: the threads come newest first,
+    so the paging stops at the first older one.
+
+    Params:
+        video_id (str): The ID of the video.
+        channel_name (str): The channel of the video, to which the quota spent is attributed in the run metrics.
+        as_records (bool): Yield records.CommentRecord objects instead of dictionaries.
+        reply_executor (ThreadPoolExecutor): The pool fetching the replies concurrently, None to fetch them serially.
+        first_page (dict): The first commentThreads.list page when it was already fetched, e.g. in a batch.
+        since (str): The publishedAt of the most recent top-level comment already ingested, None to fetch everything.
+        on_complete (callable): Called with the publishedAt of the most recent top-level comment fetched (None if
+                                there is none) once all the pages were fetched without error.
+
+    Yields:
+        dict: A comment of the video, see "get_video_comments".
+    """
+    next_page_token = None
+    more_pages = True
+    pages = 0
+    seen_ids = set()
+    last_comment_at = None
+
+    while more_pages:
+        try:
+            if first_page is not None:
+                response, first_page = first_page, None
+            else:
+                with run_metrics.scope(channel_name):
+                    response = fetch_comment_threads_page(video_id, next_page_token)
+            pages += 1
+
+        except HttpError as e:
+            # Quota errors are handled by the scheduler, what reaches here is e.g. a video with comments disabled
+            log_http_error(e, f"video ID {video_id}")
             # Skip to the next video ID after logging the error
-            continue
+            break
+
         except Exception as e:
             logger.error(f"An unexpected error occurred with video ID {video_id}: {e}")
             # Skip to the next video ID after logging the error
-            continue
-    
-        items = response.get('items', [{}])
-        for item in items:
-            try:
-                top_level_dic = {}  # Create a new dictionary for each top-level comment
-
-                snippet = item.get('snippet', {})
-                top_level_comment = snippet.get('topLevelComment', {}).get('snippet', {})
-                reply_comment = snippet.get('replies', {}).get('snippet', {})
-
-                # Extract the required details
-                top_level_dic['video_id'] = video_id
-                top_level_dic['text_original'] = top_level_comment.get('textOriginal')
-                top_level_dic['published_at'] = top_level_comment.get('publishedAt')
-                top_level_dic['like_count'] = top_level_comment.get('likeCount', 0)
-                top_level_dic['kind'] = 'top level'
-                comments.append(top_level_dic)
-
-                if top_level_comment.get('totalReplyCount', 0) != 0:
-                    reply_dict = {}
-                    replies = snippet.get('replies', {}).get('comments', {})
-                    for reply in replies:
-                        reply_dict['video_id'] = video_id
-                        reply_dict['id'] = reply.get('id', {})
-                        reply_dict['text_original'] = reply.get('snippet', {}).get('textOriginal', {})
-                        reply_dict['published_at'] = reply.get('snippet', {}).get('publishedAt', {})
-                        reply_dict['like_count'] = reply.get('snippet', {}).get('likeCount', {})
-                        reply_dict['kind'] = 'reply'
-                        reply_dict['parentId'] = reply.get('snippet', {}).get('parentId', {})
-                    comments.append(reply_dict)
-            except Exception as e:
-                logger.error(f"An error occurred while processing a comment for video ID {video_id}: {e}")
-                continue
+            break
+
+        items = response.get('items', [])
+        reached_since = False
+        if since:
+            # ISO 8601 UTC timestamps compare chronologically as strings
+            new_items = [item for item in items if _thread_published_at(item) > since]
+            reached_since = len(new_items) < len(items)
+            items = new_items
+        if items:
+            last_comment_at = max(last_comment_at or '', max(_thread_published_at(item) for item in items)) or None
+
+        harvested_replies = _harvest_replies(threads_missing_replies(items), channel_name, reply_executor)
+        comments = []
+        for comment in build_comments(items, video_id, harvested_replies):
+            comment_id = comment.get('id')
+            if comment_id is not None:
+                if comment_id in seen_ids:
+                    continue
+                seen_ids.add(comment_id)
+            comments.append(comment)
+        if as_records:
+            # Converted page by page, so that the dictionaries of a single page are alive at a time
+            comments = [CommentRecord.from_dict(comment) for comment in comments]
+        yield from comments
 
         # Handle pagination
-        more_pages = True
         next_page_token = response.get('nextPageToken')
+        more_pages = next_page_token is not None and not reached_since
 
-        while more_pages:
-            if next_page_token is None:
-                more_pages = False
-            else:
-                try:
-                    request = youtube.commentThreads().list(
-                        part="snippet,replies",
-                        videoId=video_id,
-                        maxResults=100,
-                        order='time',
-                        pageToken=next_page_token
-                    )
-                    response = request.execute()
-
-                except HttpError as e:
-
-                    try:
-                        error_details = json.loads(e.content.decode('utf-8'))
-                        error_message = error_details.get('error', {}).get('message', 'An unknown error occurred')
-                        logger.error(f"HTTP error {e.resp.status} occurred for video ID {video_id}: {error_message}")
-                        
-                        if e.resp.status == 403:
-                            logger.error(f"Quota exceeded for the day. Stopping requests until the quota resets.")
-                            # Sleep for 24 hours or until the quota reset time
-                            time.sleep(86400)
-                        continue  # continue the loop after sleeping
-
-                    except json.JSONDecodeError as parse_error:
-                        logger.error(f"Failed to parse error response for video ID {video_id}: {parse_error}")
-                        logger.error(f"Raw error content: {e.content}")
-                    continue
-                except Exception as e:
-                    logger.error(f"An unexpected error occurred with video ID {video_id}: {e}")
-                    # Skip to the next video ID after logging the error
-                    continue
+    else:
+        if on_complete is not None:
+            on_complete(last_comment_at)
+
+    run_metrics.record_pages('commentThreads', pages)
 
-                items = response.get('items', [{}])
-                next_page_token = response.get('nextPageToken')
-
-                for item in items:
-                    try:
-                        top_level_dic = {}  # Create a new dictionary for each top-level comment
-
-                        snippet = item.get('snippet', {})
-                        top_level_comment = snippet.get('topLevelComment', {}).get('snippet', {})
-                        reply_comment = snippet.get('replies', {}).get('snippet', {})
-
-                        # Extract the required details
-                        top_level_dic['video_id'] = video_id
-                        top_level_dic['text_original'] = top_level_comment.get('textOriginal')
-                        top_level_dic['published_at'] = top_level_comment.get('publishedAt')
-                        top_level_dic['like_count'] = top_level_comment.get('likeCount', 0)
-                        top_level_dic['kind'] = 'top level'
-                        comments.append(top_level_dic)
-
-                        if top_level_comment.get('totalReplyCount', 0) != 0:
-                            reply_dict = {}
-                            replies = snippet.get('replies', {}).get('comments', {})
-                            for reply in replies:
-                                reply_dict['video_id'] = video_id
-                                reply_dict['id'] = reply.get('id', {})
-                                reply_dict['text_original'] = reply.get('snippet', {}).get('textOriginal', {})
-                                reply_dict['published_at'] = reply.get('snippet', {}).get('publishedAt', {})
-                                reply_dict['like_count'] = reply.get('snippet', {}).get('likeCount', {})
-                                reply_dict['kind'] = 'reply'
-                                reply_dict['parentId'] = reply.get('snippet', {}).get('parentId', {})
-                            comments.append(reply_dict)
-                    except Exception as e:
-                        logger.error(f"An error occurred while processing a comment for video ID {video_id} on pagination: {e}")
-                        continue
 
+def delta_sync(video, state):
+    """
+    Returns how to sync the comments of a video in delta mode, see "get_video_comments".
+
+    Params:
+        video (dict): The video details, containing its 'video_id' and 'commentcount'.
+        state (SyncState): The sync state, None when the delta mode is off.
+
+    Returns:
+        tuple: (skip, since, on_complete), the arguments of "iter_comments_of_video" for the video,
+               `skip` being True when its comment count did not change since the previous run.
+    """
+    if state is None:
+        return False, None, None
+
+    video_id = video.get('video_id', '')
+    commentcount = str(video.get('commentcount', '0'))
+    previous = state.get_video_comments(video_id) or {'commentcount': '0'}
+    if previous.get('commentcount') == commentcount:
+        return True, None, None
+    return False, previous.get('last_comment_at'), partial(state.update_video_comments, video_id, commentcount)
+
+
+def _get_comments_of_video(video, as_records=False, reply_executor=None, state=None):
+    """
+    Fetches all the comments of a single video, see "iter_comments_of_video".
+
+    Params:
+        video (dict): The video details, containing its 'video_id' and 'channel_name'.
+        as_records (bool): Return records.CommentRecord objects instead of dictionaries.
+        reply_executor (ThreadPoolExecutor): The pool fetching the replies concurrently, None to fetch them serially.
+        state (SyncState): In delta mode, the sync state, see "get_video_comments".
+
+    Returns:
+        list: The comments of the video.
+    """
+    skip, since, on_complete = delta_sync(video, state)
+    if skip:
+        return []
+    return list(iter_comments_of_video(video.get('video_id', ''), video.get('channel_name'), as_records,
+                                       reply_executor, since=since, on_complete=on_complete))
+
+
+def get_comments_of_videos_batch(videos, as_records=False, reply_executor=None, state=None):
+    """
+    Fetches all the comments of several videos, their first pages being coalesced in one batch HTTP exchange,
+    see "_fetch_first_comment_pages". Only the videos having more pages go on to the normal paging.
+
+    Params:
+        videos (list): The video details, containing their 'video_id' and 'channel_name'.
+        as_records (bool): Return records.CommentRecord objects instead of dictionaries.
+        reply_executor (ThreadPoolExecutor): The pool fetching the replies concurrently, None to fetch them serially.
+        state (SyncState): In delta mode, the sync state, see "get_video_comments".
+
+    Returns:
+        list: The comments of the videos, grouped by video in the order of `videos`.
+    """
+    syncs = [(video, delta_sync(video, state)) for video in videos]
+    syncs = [(video, since, on_complete) for video, (skip, since, on_complete) in syncs if not skip]
+    first_pages, skipped = _fetch_first_comment_pages([video for video, _, _ in syncs])
+    comments = []
+    for index, (video, since, on_complete) in enumerate(syncs):
+        if index in skipped:
+            continue
+        comments.extend(iter_comments_of_video(video.get('video_id', ''), video.get('channel_name'), as_records,
+                                               reply_executor, first_pages.get(index), since, on_complete))
     return comments
 
 
+def get_video_comments(videos_info, max_workers=1, as_records=False, batch_size=None, state=None):
+    """
+    Fetches comments for a list of YouTube videos based on their IDs.
+
+    Params:
+        videos_info (list): A list of dictionaries, each containing a 'video_id' key with the YouTube video ID.
+        max_workers (int): The number of videos whose comments are paged concurrently, each worker using its own API client. 1 to run serially.
+                           The replies missing from the comment threads are fetched by a second pool of the same size.
+        as_records (bool): Return records.CommentRecord objects, with typed values and interned video IDs, instead of dictionaries.
+        batch_size (int): Coalesce the first-page requests of up to `batch_size` videos in one batch HTTP exchange
+                          (e.g. DEFAULT_BATCH_SIZE), the videos with more comments are then paged normally.
+                          None to send one request per page.
+        state (SyncState): Delta mode: only fetch the comments posted since the previous run. Videos whose
+                           'commentcount' did not change are skipped, the others are paged until the last top-level
+                           comment already ingested. The state is updated but not saved: save it once the comments
+                           are stored, so that a failed upload is fetched again. Replies posted since the previous
+                           run to older threads are not fetched.
+
+    Returns:
+        list: A list of dictionaries, each containing details about a comment, grouped by video in the order of `videos_info`. Each dictionary includes:
+            - 'video_id': The unique identifier for the video.
+            - 'id': The unique identifier for the comment.
+            - 'text_original': The original text of the comment.
+            - 'published_at': The publication date of the comment.
+            - 'like_count': The number of likes the comment has received.
+            - 'kind': Indicates whether the comment is a 'top level' comment or a 'reply'.
+            - 'parentId' (optional): The ID of the parent comment if the comment is a reply.
+    """
+    executor = create_executor(max_workers)
+    # The replies get their own pool: a video worker waiting on reply tasks queued behind other videos would deadlock
+    reply_executor = create_executor(max_workers)
+    try:
+        if batch_size:
+            results = _map(executor, partial(get_comments_of_videos_batch, as_records=as_records,
+                                            reply_executor=reply_executor, state=state),
+                           list(chunks(list(videos_info), batch_size)))
+        else:
+            results = _map(executor, partial(_get_comments_of_video, as_records=as_records,
+                                             reply_executor=reply_executor, state=state), videos_info)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+            reply_executor.shutdown()
+
+    return [comment for video_comments in results for comment in video_comments]
+
+
+
+def iter_video_comments(videos_info, max_workers=1, as_records=False, batch_size=None, state=None):
+    """
+    Streaming counterpart of "get_video_comments": yields the comments as the commentThreads.list pages arrive.
+
+    Serially, only one page of comments is held in memory at a time. With `max_workers` above 1, the comments
+    of at most 2 * `max_workers` videos are fetched ahead, each worker using its own API client.
+
+    Params:
+        videos_info (iterable): Dictionaries each containing a 'video_id' key, e.g. the output of "iter_videos_info".
+        max_workers (int): The number of videos whose comments are paged concurrently, 1 to run serially.
+        as_records (bool): Yield records.CommentRecord objects instead of dictionaries.
+        batch_size (int): Coalesce the first-page requests of up to `batch_size` videos in one batch HTTP exchange,
+                          see "get_video_comments". The comments are then held in memory a batch of videos at a time.
+        state (SyncState): Delta mode, see "get_video_comments". The state is updated as the videos complete.
+
+    Yields:
+        dict: A comment, see "get_video_comments", grouped by video in the order of `videos_info`.
+    """
+    executor = create_executor(max_workers)
+    if batch_size:
+        func = get_comments_of_videos_batch
+        videos_info = ichunks(videos_info, batch_size)
+    else:
+        func = _get_comments_of_video
+
+    if executor is None:
+        if batch_size:
+            for videos in videos_info:
+                yield from get_comments_of_videos_batch(videos, as_records, state=state)
+            return
+        for video in videos_info:
+            skip, since, on_complete = delta_sync(video, state)
+            if not skip:
+                yield from iter_comments_of_video(video.get('video_id', ''), video.get('channel_name'), as_records,
+                                                  since=since, on_complete=on_complete)
+        return
+
+    reply_executor = create_executor(max_workers)
+    try:
+        for video_comments in _imap(executor, partial(func, as_records=as_records, reply_executor=reply_executor,
+                                                      state=state),
+                                    videos_info, window=2 * max_workers):
+            yield from video_comments
+    finally:
+        executor.shutdown(cancel_futures=True)
+        reply_executor.shutdown(cancel_futures=True)
+
 
 if __name__ == "__main__":
 
@@ -395,4 +1304,3 @@ if __name__ == "__main__":
     # Open the file in write mode and use json.dump to write the data
     with open(filename_comments, 'w') as json_file:
         json.dump(video_comments, json_file, indent=4)  # indent=4 makes the JSON pretty-printed
-